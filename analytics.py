@@ -0,0 +1,119 @@
+import asyncio
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models import PriceObservation
+
+SECONDS_PER_DAY = 86400.0
+
+
+class PriceStats(NamedTuple):
+    count: int
+    first_at: float  # Unix seconds
+    last_at: float
+    latest: float
+    low: float
+    high: float
+    median: float
+    p10: float
+    p25: float
+    p75: float
+    p90: float
+    trend_per_day: float  # least-squares slope, in currency units per day
+    latest_rank: float    # share of observations at or below the latest price
+
+
+PERCENTILES = np.array([0.10, 0.25, 0.50, 0.75, 0.90])
+
+
+def summarize(key_columns: Sequence[np.ndarray], times: np.ndarray, prices: np.ndarray) -> Dict[tuple, PriceStats]:
+    """
+    Stats for every key in one pass over contiguous arrays. Row i belongs to the key
+    (key_columns[0][i], key_columns[1][i], ...); rows must be grouped by key and in time
+    order within each key.
+    """
+    n = len(prices)
+    if n == 0:
+        return {}
+    changed = np.zeros(n - 1, dtype=bool)
+    for column in key_columns:
+        changed |= column[1:] != column[:-1]
+    starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+    ends = np.append(starts[1:], n)
+    counts = ends - starts
+    group = np.repeat(np.arange(len(starts)), counts)
+    low = np.minimum.reduceat(prices, starts)
+    high = np.maximum.reduceat(prices, starts)
+    latest = prices[ends - 1]
+    # Slope of price over days since each key's first observation, from per-key sums
+    days = (times - times[starts][group]) / SECONDS_PER_DAY
+    sum_x = np.add.reduceat(days, starts)
+    sum_y = np.add.reduceat(prices, starts)
+    sum_xx = np.add.reduceat(days * days, starts)
+    sum_xy = np.add.reduceat(days * prices, starts)
+    denominator = counts * sum_xx - sum_x * sum_x
+    slope = np.divide(counts * sum_xy - sum_x * sum_y, denominator,
+                      out=np.zeros(len(starts)), where=denominator > 1e-12)
+    rank = np.add.reduceat(prices <= latest[group], starts) / counts
+    # Percentiles of every group at once: sort by (group, price), then interpolate linearly
+    # between neighbouring ranks as np.percentile does
+    ordered = prices[np.lexsort((prices, group))]
+    position = (counts[:, None] - 1) * PERCENTILES
+    below = np.floor(position).astype(np.int64)
+    above = np.minimum(below + 1, counts[:, None] - 1)
+    low_values = ordered[starts[:, None] + below]
+    percentiles = low_values + (ordered[starts[:, None] + above] - low_values) * (position - below)
+
+    keys = zip(*(column[starts].tolist() for column in key_columns))
+    return {key: PriceStats(count, first_at, last_at, *values)
+            for key, count, first_at, last_at, *values in zip(
+                keys, counts.tolist(), times[starts].tolist(), times[ends - 1].tolist(), latest.tolist(),
+                low.tolist(), high.tolist(), percentiles[:, 2].tolist(), percentiles[:, 0].tolist(),
+                percentiles[:, 1].tolist(), percentiles[:, 3].tolist(), percentiles[:, 4].tolist(),
+                slope.tolist(), rank.tolist())}
+
+
+class PriceAnalytics:
+    """
+    /stats figures per (search_query, currency) over the last `window_days` of price history.
+    Results are cached until new observations for the query are recorded (see invalidate),
+    so asking again, or asking about many trackings, doesn't go back to the database.
+    """
+
+    def __init__(self, user_manager, window_days: float = 90):
+        self.user_manager = user_manager
+        self.window_days = window_days
+        self._cache: Dict[Tuple[str, str], Optional[PriceStats]] = {}
+        self._generation = 0
+
+    def invalidate(self, observations: Iterable[PriceObservation]):
+        for observation in observations:
+            self._cache.pop((observation.search_query, observation.currency), None)
+        self._generation += 1
+
+    async def stats(self, queries: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[PriceStats]]:
+        """Stats per (search_query, currency); None for a query with no observations yet"""
+        queries = list(dict.fromkeys(queries))
+        missing = [query for query in queries if query not in self._cache]
+        computed = {}
+        if missing:
+            generation = self._generation
+            since = time.time() - self.window_days * SECONDS_PER_DAY
+            rows = await self.user_manager.get_price_history(missing, since)
+            computed = await asyncio.to_thread(self._summarize_rows, rows)
+            # Observations recorded while we were reading would be missing from these figures
+            if generation == self._generation:
+                for query in missing:
+                    self._cache[query] = computed.get(query)
+        return {query: self._cache[query] if query in self._cache else computed.get(query)
+                for query in queries}
+
+    @staticmethod
+    def _summarize_rows(rows) -> Dict[Tuple[str, str], PriceStats]:
+        if not rows:
+            return {}
+        queries, currencies, times, prices = zip(*rows)
+        return summarize((np.array(queries), np.array(currencies)),
+                         np.array(times, dtype=np.float64), np.array(prices, dtype=np.float64))
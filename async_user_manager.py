@@ -0,0 +1,183 @@
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterable, Tuple
+
+from models import Tracking, ApiCall, PriceObservation, KnownProduct
+from user_manager import UserManager
+from connection_pool import ConnectionPool, open_write_connection
+
+
+class AsyncUserManager:
+    """
+    Async facade over UserManager so handlers and the checker never block the event loop.
+
+    Writes are queued to one writer thread that owns the write connection; it takes
+    whatever has queued up (up to `max_batch` operations), runs them in a single
+    transaction and commits once, then resolves their futures. Reads run on a thread
+    pool the same size as the read-only ConnectionPool they draw from, so they never
+    queue behind the writer.
+    """
+
+    def __init__(self, db_path: str, readers: int = 4, max_batch: int = 64, cached_statements: int = 256):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.cached_statements = cached_statements
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._init_error = None
+        self.read_pool = ConnectionPool(db_path, size=readers, cached_statements=cached_statements)
+        self._read_manager = None
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._writer = threading.Thread(target=self._run_writer, name="db-writer", daemon=True)
+        self._writer.start()
+        # Schema setup happens on the writer connection; readers must not start before it's done
+        self._ready.wait()
+        if self._init_error:
+            raise self._init_error
+        # Only reads go through this one, so it never touches its (unused) write connection
+        self._read_manager = UserManager(None, init_db=False, read_pool=self.read_pool)
+
+    def _run_writer(self):
+        try:
+            manager = UserManager(open_write_connection(self.db_path, self.cached_statements))
+        except Exception as e:
+            self._init_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)
+                    break
+                batch.append(job)
+
+            outcomes = []
+            try:
+                with manager.group_commit():
+                    for method, args, kwargs, future in batch:
+                        try:
+                            outcomes.append((future, getattr(manager, method)(*args, **kwargs), None))
+                        except Exception as e:
+                            outcomes.append((future, None, e))
+            except Exception as e:
+                # The COMMIT itself failed, so nothing in this batch was written
+                outcomes = [(future, None, e) for _, _, _, future in batch]
+
+            # Only report success once the group is durable
+            for future, result, error in outcomes:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        manager.conn.close()
+
+    async def _read(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = getattr(self._read_manager, method)
+        return await loop.run_in_executor(self._readers, lambda: call(*args, **kwargs))
+
+    async def _write(self, method, *args, **kwargs):
+        future = Future()
+        self._queue.put((method, args, kwargs, future))
+        return await asyncio.wrap_future(future)
+
+    # Reads
+
+    async def get_all_trackings(self) -> List[Tracking]:
+        return await self._read("get_all_trackings")
+
+    async def get_due_trackings(self, due_before: str,
+                                keys: Optional[List[Tuple[int, str]]] = None) -> List[Tracking]:
+        return await self._read("get_due_trackings", due_before, keys)
+
+    async def get_sweep_cursor(self) -> Optional[Dict]:
+        return await self._read("get_sweep_cursor")
+
+    async def get_tracked_items(self, user_id: int) -> List[Tracking]:
+        return await self._read("get_tracked_items", user_id)
+
+    async def find_trackings(self, user_id: int, product_name: str, limit: int = 10) -> List[Dict]:
+        return await self._read("find_trackings", user_id, product_name, limit)
+
+    async def get_marketplaces(self, user_id: int) -> Optional[List[str]]:
+        return await self._read("get_marketplaces", user_id)
+
+    async def get_pending_alerts(self, limit: int = 50) -> List[Dict]:
+        return await self._read("get_pending_alerts", limit)
+
+    async def get_credit_usage(self, since: str) -> Dict[str, int]:
+        return await self._read("get_credit_usage", since)
+
+    async def get_price_history(self, queries: List[Tuple[str, str]], since: float) -> List[tuple]:
+        return await self._read("get_price_history", list(queries), since)
+
+    async def get_media_file_ids(self, limit: int) -> List[Tuple[str, str]]:
+        return await self._read("get_media_file_ids", limit)
+
+    async def get_products(self, limit: int) -> List[KnownProduct]:
+        return await self._read("get_products", limit)
+
+    # Writes
+
+    async def add_tracking(self, user_id: int, product_name: str,
+                           target_price: float, sku: str, product_data: dict):
+        return await self._write("add_tracking", user_id, product_name, target_price, sku, product_data)
+
+    async def add_trackings(self, items: Iterable[Dict]) -> List[bool]:
+        return await self._write("add_trackings", list(items))
+
+    async def update_target_prices(self, updates: Iterable[Tuple[int, str, float]]) -> List[bool]:
+        return await self._write("update_target_prices", list(updates))
+
+    async def remove_trackings(self, keys: Iterable[Tuple[int, str]]) -> List[bool]:
+        return await self._write("remove_trackings", list(keys))
+
+    async def remove_tracking(self, user_id: int, product_name: str) -> bool:
+        return await self._write("remove_tracking", user_id, product_name)
+
+    async def remove_tracking_by_name(self, user_id: int, product_name: str) -> bool:
+        return await self._write("remove_tracking_by_name", user_id, product_name)
+
+    async def set_marketplaces(self, user_id: int, marketplaces: List[str]):
+        return await self._write("set_marketplaces", user_id, list(marketplaces))
+
+    async def record_deals(self, messages: List[Dict], finished: List[tuple], checked: Iterable[tuple] = (),
+                           checked_at: Optional[str] = None) -> int:
+        return await self._write("record_deals", messages, finished, list(checked), checked_at)
+
+    async def set_sweep_cursor(self, cursor: Dict):
+        return await self._write("set_sweep_cursor", dict(cursor))
+
+    async def mark_alerts_sent(self, alert_ids: List[int]):
+        return await self._write("mark_alerts_sent", list(alert_ids))
+
+    async def record_api_calls(self, calls: List[ApiCall]):
+        return await self._write("record_api_calls", list(calls))
+
+    async def record_price_observations(self, observations: List[PriceObservation]):
+        return await self._write("record_price_observations", list(observations))
+
+    async def save_media_file_ids(self, entries: List[Tuple[str, str]], evicted: List[str] = ()):
+        return await self._write("save_media_file_ids", list(entries), list(evicted))
+
+    async def save_products(self, products: List[KnownProduct], keep: int):
+        return await self._write("save_products", list(products), keep)
+
+    def close(self):
+        """Finish queued writes, then stop the writer and reader threads"""
+        self._queue.put(None)
+        self._writer.join()
+        self._readers.shutdown(wait=True)
+        self.read_pool.close()
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+def month_bounds(now: datetime) -> Tuple[datetime, datetime]:
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+class CreditPlanner:
+    """
+    Spreads a monthly Rainforest credit budget over the sweeps left in the month.
+
+    Each sweep may spend (budget - reserve - used so far) / sweeps remaining, so credits a
+    sweep doesn't use roll over to the next ones. Queries are checked least-recently-checked
+    first (ties go to the query more trackings depend on) until the sweep's allowance is
+    spent; the rest wait for a later sweep. Allowance a sweep leaves unspent is carried
+    into the next one (up to the cost of its dearest query) so a budget of less than one
+    check per sweep still checks something every few sweeps. `reserve` is the share of
+    the budget kept back for onboarding searches. `min_interval` is the shortest time
+    between two checks of one query however large the budget (a timing wheel rotation,
+    when each "sweep" is one of its ticks); it defaults to `sweep_interval`.
+    """
+
+    def __init__(self, monthly_budget: int, sweep_interval: float = 3600, reserve: float = 0.1,
+                 smoothing: float = 0.3, min_interval: Optional[float] = None):
+        self.monthly_budget = monthly_budget
+        self.sweep_interval = sweep_interval
+        self.min_interval = min_interval or sweep_interval
+        self.reserve = reserve
+        self.smoothing = smoothing
+        self._cost: Dict[Hashable, float] = {}
+        self._last_checked: Dict[Hashable, datetime] = {}
+        self._carry = 0.0
+
+    def estimate(self, key: Hashable, default: float) -> float:
+        """Expected credits for one check of `key` (a moving average of what past checks cost)"""
+        return self._cost.get(key, default)
+
+    def observe(self, key: Hashable, credits: int, when: datetime):
+        previous = self._cost.get(key)
+        self._cost[key] = credits if previous is None else (
+            self.smoothing * credits + (1 - self.smoothing) * previous)
+        self._last_checked[key] = when
+
+    def sweeps_left(self, now: datetime) -> int:
+        _, end = month_bounds(now)
+        return max(1, int((end - now).total_seconds() // self.sweep_interval))
+
+    def sweep_allowance(self, used: int, now: datetime) -> float:
+        spendable = self.monthly_budget * (1 - self.reserve) - used
+        return max(0.0, spendable / self.sweeps_left(now))
+
+    def plan(self, candidates: List[Tuple[Hashable, int, float]], used: int,
+             now: datetime) -> Tuple[List[Hashable], List[Hashable]]:
+        """
+        `candidates` are (key, number of trackings, default cost) per query.
+        Returns (keys to check this sweep, keys deferred to a later sweep).
+        """
+        allowance = self.sweep_allowance(used, now)
+        available = allowance + self._carry if allowance > 0 else 0.0
+        ordered = sorted(candidates, key=lambda c: (self._last_checked.get(c[0], datetime.min), -c[1]))
+        checked, deferred = [], []
+        planned = 0.0
+        dearest = 0.0
+        for key, _, default_cost in ordered:
+            cost = self.estimate(key, default_cost)
+            dearest = max(dearest, cost)
+            if planned + cost <= available:
+                checked.append(key)
+                planned += cost
+            else:
+                deferred.append(key)
+        self._carry = min(available - planned, dearest)
+        return checked, deferred
+
+    def check_interval(self, candidates: List[Tuple[Hashable, int, float]], used: int,
+                       now: datetime) -> Optional[timedelta]:
+        """How often each query can be checked at the current allowance (None if not at all)"""
+        full_sweep = sum(self.estimate(key, default_cost) for key, _, default_cost in candidates)
+        allowance = self.sweep_allowance(used, now)
+        if allowance <= 0:
+            return None
+        return timedelta(seconds=max(self.min_interval, full_sweep / allowance * self.sweep_interval))
+
+    def projected_usage(self, used: int, now: datetime) -> float:
+        """Month-end usage if the rest of the month spends at the month-to-date rate"""
+        start, end = month_bounds(now)
+        elapsed = (now - start).total_seconds()
+        if elapsed <= 0:
+            return float(used)
+        return used * (end - start).total_seconds() / elapsed
@@ -0,0 +1,314 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+_NON_ALNUM = re.compile(r'[^a-z0-9\s]')
+_DIGIT_ALPHA = re.compile(r'(\d)([a-z])')
+_ALPHA_DIGIT = re.compile(r'([a-z])(\d)')
+_SPACES = re.compile(r'\s+')
+
+
+def clean_text(text: str) -> str:
+    """
+    Lowercase, drop punctuation and split digits from letters:
+    "iPhone14 Pro-Max" -> "iphone 14 pro max"
+    """
+    if not text:
+        return ""
+    text = _NON_ALNUM.sub(' ', text.lower())
+    text = _DIGIT_ALPHA.sub(r'\1 \2', text)
+    text = _ALPHA_DIGIT.sub(r'\1 \2', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def tokenize(text: str) -> Tuple[str, ...]:
+    return tuple(clean_text(text).split())
+
+
+def _compile_words(keywords: Iterable[str]) -> Optional[re.Pattern]:
+    """Regex finding any of `keywords` as whole words of clean_text() output"""
+    keywords = sorted({clean_text(k) for k in keywords} - {""}, key=len, reverse=True)
+    if not keywords:
+        return None
+    return re.compile(r"(?<![a-z0-9])(?:" + "|".join(re.escape(k) for k in keywords) + r")(?![a-z0-9])")
+
+
+def _compile_any(keywords: Iterable[str]) -> Optional[re.Pattern]:
+    """One alternation regex doing the same substring test as `any(k in title for k in keywords)`"""
+    keywords = sorted({k.lower() for k in keywords}, key=len, reverse=True)
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+
+@dataclass(frozen=True)
+class QueryField:
+    key: str                    # context.user_data key holding the user's answer
+    skip: Optional[str] = None  # answer that means "don't filter on this"
+
+
+@dataclass(frozen=True)
+class CategorySpec:
+    name: str
+    query_fields: Tuple[QueryField, ...]
+    min_query_terms: int = 1
+    dedup_query: bool = False
+    blocked_keywords: Tuple[str, ...] = ()
+    required_keywords: Tuple[str, ...] = ()  # title must contain at least one of these
+    match_threshold: float = 0.9
+    stop_words: Tuple[str, ...] = ()
+    # Prompts for the generic name -> manufacturer -> price flow (categories without a bespoke flow)
+    name_prompt: Optional[str] = None
+    manufacturer_prompt: Optional[str] = None
+    # Words in a free-text product name that point to this category (see infer_category)
+    name_keywords: Tuple[str, ...] = ()
+
+
+class Category:
+    """A CategorySpec compiled for the hot path: keyword lists become single regexes."""
+
+    def __init__(self, spec: CategorySpec):
+        self.spec = spec
+        self.name = spec.name
+        self.match_threshold = spec.match_threshold
+        self._blocked = _compile_any(spec.blocked_keywords)
+        self._required = _compile_any(spec.required_keywords)
+        self._stop_words = frozenset(spec.stop_words)
+        self._name_keywords = _compile_words(spec.name_keywords)
+
+    def build_query(self, answers: Mapping) -> Optional[str]:
+        """Search term built from the user's answers, or None if there aren't enough of them"""
+        filters = []
+        for field in self.spec.query_fields:
+            value = answers.get(field.key)
+            if not value or value == field.skip or value == "Skip":
+                continue
+            filters.append(value.strip())
+
+        if self.spec.dedup_query:
+            filters = list(dict.fromkeys(f.lower() for f in filters if f))
+
+        if len(filters) < self.spec.min_query_terms:
+            return None
+        return ' '.join(filters).strip()
+
+    def query_terms(self, search_query: str) -> Tuple[str, ...]:
+        """Tokens of the query that a title has to contain (stop words don't count)"""
+        words = tokenize(search_query)
+        if len(words) == 1:
+            return words
+        return tuple(w for w in words if w not in self._stop_words)
+
+    def classify(self, title: str, query_terms: Tuple[str, ...] = (),
+                 title_tokens: Optional[Tuple[str, ...]] = None) -> Tuple[bool, float]:
+        """
+        Filter and score a title in one pass.
+        Returns (is_real_product, match_score) where match_score is the share of
+        query_terms found in the title. Pass `title_tokens` when the title was
+        already tokenized (SearchResult.tokens) to skip doing it again.
+        """
+        if not title:
+            return False, 0.0
+        lowered = title.lower()
+        if self._blocked is not None and self._blocked.search(lowered):
+            return False, 0.0
+        if self._required is not None and not self._required.search(lowered):
+            return False, 0.0
+        if not query_terms:
+            return True, 0.0
+        tokens = set(title_tokens if title_tokens is not None else tokenize(lowered))
+        score = sum(1 for term in query_terms if term in tokens) / len(query_terms)
+        return True, score
+
+    def is_match(self, score: float) -> bool:
+        return score >= self.match_threshold
+
+    def name_score(self, product_name: str) -> int:
+        """How strongly a product name points to this category: characters of name keywords it contains"""
+        if self._name_keywords is None:
+            return 0
+        if self._blocked is not None and self._blocked.search(product_name.lower()):
+            return 0
+        return sum(len(keyword) for keyword in self._name_keywords.findall(clean_text(product_name)))
+
+
+CATEGORY_SPECS = (
+    CategorySpec(
+        name="Phones",
+        query_fields=(
+            QueryField("mobile_manufacturer_name", "Skip Manufacturer"),
+            QueryField("product_name"),
+            QueryField("model_name", "Skip Model"),
+            QueryField("mobile_storage", "Skip Storage"),
+        ),
+        min_query_terms=2,
+        blocked_keywords=(
+            # Accessories
+            "case", "cover", "screen protector", "charger", "cable", "wireless charger", "earbud", "earphones",
+            "headphones",
+            # Storage
+            "usb", "flash drive", "memory stick", "sd card", "micro sd", "external storage",
+            # Pens & Stylus
+            "pen", "stylus", "touch pen",
+            # Misc gadgets
+            "tripod", "mount", "stand", "holder", "pop socket", "ring light", "camera lens",
+            # SIM & Cards
+            "sim card", "sim tool", "nano sim", "adapter",
+            # Tablets & Smartwatches
+            "tablet", "ipad", "watch", "smartwatch", "fitness tracker", "band",
+            # Household/Random
+            "remote", "fan", "lamp", "light bulb", "calculator", "speaker", "radio",
+            # Toys & Knockoffs
+            "toy", "kids phone", "fake phone", "learning phone",
+            # Brands not phones
+            "logitech", "sandisk", "kingston", "tp-link", "netgear", "jbl", "anker", "bose",
+        ),
+        name_keywords=(
+            "phone", "smartphone", "iphone", "galaxy s", "galaxy z", "galaxy a", "pixel", "oneplus",
+            "moto g", "motorola", "xperia", "nothing phone", "redmi", "xiaomi",
+        ),
+    ),
+    CategorySpec(
+        name="Laptops",
+        query_fields=(
+            QueryField("laptop_manufacturer_name", "Skip Manufacturer"),
+            QueryField("product_name"),
+            QueryField("laptop_processor", "Skip Processor"),
+            QueryField("laptop_ram", "Skip RAM"),
+            QueryField("laptop_storage", "Skip Storage"),
+        ),
+        min_query_terms=2,
+        dedup_query=True,
+        blocked_keywords=(
+            # Accessories (explicit ones only)
+            "laptop case", "sleeve", "keyboard cover", "screen protector", "cooling pad",
+            "mount", "docking station", "usb hub", "mouse only", "keyboard only",
+            "external hard drive", "external ssd", "webcam only", "microphone only",
+            # Components as standalone items (not inside laptops)
+            "ram module", "memory module", "barebone ssd", "barebone hdd", "graphics card", "motherboard",
+            "cpu only", "processor only",
+            # Non-laptop devices
+            "tablet", "ipad", "chromebook", "netbook", "surface go", "surface pro", "kindle",
+            # Brands that don’t sell laptops
+            "logitech", "sandisk", "kingston", "tp-link", "netgear", "jbl", "anker", "bose", "asus router",
+            # Other electronics
+            "battery replacement", "power adapter", "charger only", "stylus pen", "drawing tablet",
+            "projector", "printer", "scanner", "monitor only", "screen extender", "ethernet cable",
+            # Toys or fake items
+            "toy", "kids laptop", "learning computer", "fake laptop", "replica laptop", "training toy",
+            # Home items
+            "lamp", "fan", "calculator", "radio", "speaker only", "router", "switch", "modem",
+        ),
+        name_keywords=(
+            "laptop", "notebook", "macbook", "thinkpad", "ideapad", "yoga", "legion", "zenbook", "vivobook",
+            "rog zephyrus", "rog strix", "xps", "inspiron", "latitude", "alienware", "pavilion", "spectre",
+            "envy", "omen", "aspire", "predator", "swift", "surface laptop", "blade", "galaxy book",
+        ),
+    ),
+    CategorySpec(
+        name="Gaming",
+        query_fields=(
+            QueryField("gaming_manufacturer_name", "Skip Manufacturer"),
+            QueryField("product_name"),
+        ),
+        required_keywords=(
+            "playstation 5 console", "ps5 console", "xbox series x console",
+            "xbox console", "xbox series s", "nintendo switch console",
+        ),
+        stop_words=("limited", "special", "collectors", "edition", "bundle"),
+        name_keywords=(
+            "console", "playstation", "ps5", "ps4", "xbox", "nintendo switch", "switch oled", "switch lite",
+            "steam deck",
+        ),
+    ),
+    CategorySpec(
+        name="Headphones",
+        query_fields=(
+            QueryField("manufacturer_name", "Skip Manufacturer"),
+            QueryField("product_name"),
+        ),
+        blocked_keywords=(
+            "ear tips", "ear pads", "earpads", "replacement pads", "cushion", "headband cover",
+            "headphone stand", "headphone hanger", "holder", "carrying case", "protective case",
+            "silicone case", "case cover", "skin", "sticker", "audio cable", "aux cable",
+            "splitter", "extension cable", "adapter", "toy",
+        ),
+        stop_words=("wireless", "headphones", "earbuds"),
+        name_prompt=(
+            "🎧 Nice! Which headphones would you like to track?\n"
+            "For example: WH-1000XM5, AirPods Pro, QuietComfort Ultra"
+        ),
+        manufacturer_prompt="Who makes the headphones you're looking for?\n(e.g., Sony, Bose, Apple, JBL, Beats):",
+        name_keywords=(
+            "headphones", "headphone", "headset", "earbuds", "earphones", "airpods", "wh 1000", "wf 1000",
+            "quietcomfort", "beats", "galaxy buds", "pixel buds", "sennheiser", "momentum",
+        ),
+    ),
+    CategorySpec(
+        name="TVs",
+        query_fields=(
+            QueryField("manufacturer_name", "Skip Manufacturer"),
+            QueryField("product_name"),
+        ),
+        blocked_keywords=(
+            "wall mount", "tv mount", "bracket", "tv stand", "remote", "hdmi", "cable", "antenna",
+            "screen protector", "tv cover", "dust cover", "soundbar", "sound bar", "cleaning",
+            "streaming stick", "fire tv stick", "backlight", "replacement", "toy",
+        ),
+        stop_words=("tv", "television", "smart"),
+        name_prompt=(
+            "📺 Got it! Which TV would you like to track?\n"
+            "For example: Bravia XR A80L 65, OLED C3 55, QN90C"
+        ),
+        manufacturer_prompt="Who makes the TV you're looking for?\n(e.g., Samsung, LG, Sony, TCL, Hisense):",
+        name_keywords=("tv", "television", "oled", "qled", "neo qled", "bravia", "hisense", "tcl", "roku tv"),
+    ),
+    CategorySpec(
+        name="Cameras",
+        query_fields=(
+            QueryField("manufacturer_name", "Skip Manufacturer"),
+            QueryField("product_name"),
+        ),
+        blocked_keywords=(
+            "camera bag", "camera case", "strap", "tripod", "lens cap", "lens hood", "filter",
+            "battery", "charger", "memory card", "sd card", "screen protector", "cleaning", "mount",
+            "ring light", "microphone", "remote", "skin", "dummy", "toy", "kids camera",
+            "security camera", "dash cam", "webcam", "trail camera",
+        ),
+        stop_words=("camera", "digital"),
+        name_prompt=(
+            "📷 Great choice! Which camera would you like to track?\n"
+            "For example: Alpha a7 IV, EOS R6 Mark II, X-T5"
+        ),
+        manufacturer_prompt="Who makes the camera you're looking for?\n(e.g., Sony, Canon, Nikon, Fujifilm):",
+        name_keywords=(
+            "camera", "mirrorless", "dslr", "alpha a7", "a7 iv", "a6700", "eos", "nikon z", "fujifilm", "x t5",
+            "lumix", "gopro", "hero", "powershot", "instax",
+        ),
+    ),
+)
+
+
+def compile_categories(specs: Iterable[CategorySpec]) -> Dict[str, Category]:
+    return {spec.name: Category(spec) for spec in specs}
+
+
+# Compiled once at import so handlers and the checker share the same pipeline
+CATEGORIES = compile_categories(CATEGORY_SPECS)
+
+
+def get_category(name: Optional[str]) -> Optional[Category]:
+    return CATEGORIES.get(name) if name else None
+
+
+def infer_category(product_name: str) -> Optional[Category]:
+    """
+    Category a free-text product name most likely belongs to (for /track "Name" price):
+    the one whose name keywords cover most of it, ignoring categories whose blocked
+    keywords it contains. None when nothing matches or the best two tie.
+    """
+    scores = sorted(((category.name_score(product_name), category) for category in CATEGORIES.values()),
+                    key=lambda pair: pair[0], reverse=True)
+    if not scores or scores[0][0] == 0 or (len(scores) > 1 and scores[1][0] == scores[0][0]):
+        return None
+    return scores[0][1]
@@ -0,0 +1,113 @@
+import time
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+def open_write_connection(db_path: str, cached_statements: int = 256) -> sqlite3.Connection:
+    """The single read-write connection: WAL so readers never block on it (or it on them)"""
+    conn = sqlite3.connect(db_path, cached_statements=cached_statements, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of read-only connections to a WAL database.
+
+    Connections are opened lazily up to `size`, each with its own prepared-statement
+    cache, and handed out LIFO so hot connections keep warm caches. A connection
+    idle for longer than `health_check_after` seconds is pinged before use and
+    replaced if the ping fails; one that raised a DatabaseError is discarded.
+    """
+
+    def __init__(self, db_path: str, size: int = 4, cached_statements: int = 256,
+                 acquire_timeout: float = 10.0, health_check_after: float = 30.0):
+        self.db_path = db_path
+        self.size = size
+        self.cached_statements = cached_statements
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True,
+                               cached_statements=self.cached_statements, check_same_thread=False)
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._opened < self.size
+                    if can_open:
+                        self._opened += 1
+                if can_open:
+                    try:
+                        return self._open()
+                    except Exception:
+                        with self._lock:
+                            self._opened -= 1
+                        raise
+                try:
+                    conn, idle_since = self._idle.get(timeout=self.acquire_timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No database connection free after {self.acquire_timeout}s")
+
+            if time.monotonic() - idle_since < self.health_check_after or self._healthy(conn):
+                return conn
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except sqlite3.DatabaseError:
+            self._discard(conn)
+            raise
+        except BaseException:
+            self._release(conn)
+            raise
+        self._release(conn)
+
+    def _release(self, conn: sqlite3.Connection):
+        if self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
@@ -0,0 +1,126 @@
+"""
+Database stress test: many concurrent /list readers against sweeps that write.
+
+Seeds `--users` users with `--per-user` trackings each, then runs `--sweeps` sweep-sized
+write rounds through AsyncUserManager (every tracking's target price moved in one bulk
+update, plus alerts queued in the outbox, trackings marked checked and delivered alerts
+marked sent) while `--readers` tasks keep reading random users' trackings and the outbox
+through the read-only connection pool. Fails if any operation raises or a reader sees a
+torn or stale snapshot: a user's trackings must all carry the same sweep's price, never
+one older than that reader saw before, and the outbox must never repeat or reorder ids.
+
+    python db_stress_test.py --readers 64 --sweeps 20
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, List
+
+from async_user_manager import AsyncUserManager
+
+
+class Reader:
+    def __init__(self, user_manager: AsyncUserManager, users: int, per_user: int):
+        self.user_manager = user_manager
+        self.users = users
+        self.per_user = per_user
+        self.seen: Dict[int, float] = {}
+        self.reads = 0
+        self.latencies: List[float] = []
+        self.errors: List[str] = []
+
+    async def run(self, done: asyncio.Event):
+        while not done.is_set():
+            user_id = random.randint(1, self.users)
+            started = time.perf_counter()
+            try:
+                items = await self.user_manager.get_tracked_items(user_id)
+                alerts = await self.user_manager.get_pending_alerts(limit=100)
+            except Exception as e:
+                self.errors.append(f"read failed: {e!r}")
+                continue
+            self.latencies.append(time.perf_counter() - started)
+            self.reads += 1
+            prices = {item.target_price for item in items}
+            if len(items) != self.per_user or len(prices) != 1:
+                self.errors.append(f"user {user_id}: torn read, {len(items)} trackings at prices {sorted(prices)}")
+                continue
+            price = prices.pop()
+            if price < self.seen.get(user_id, 0):
+                self.errors.append(f"user {user_id}: went back from sweep {self.seen[user_id]} to {price}")
+            self.seen[user_id] = price
+            ids = [alert['id'] for alert in alerts]
+            if ids != sorted(set(ids)):
+                self.errors.append(f"outbox ids out of order or repeated: {ids[:10]}...")
+
+
+async def sweep(user_manager: AsyncUserManager, number: int, keys: List[tuple], alerts_per_sweep: int):
+    await user_manager.update_target_prices([(user_id, name, float(number)) for user_id, name in keys])
+    messages = [{'idempotency_key': f"sweep-{number}-{n}", 'user_id': keys[n][0],
+                 'payload': {'text': f"Deal {n} from sweep {number}"}}
+                for n in range(alerts_per_sweep)]
+    await user_manager.record_deals(messages, [], keys, None)
+    pending = await user_manager.get_pending_alerts(limit=alerts_per_sweep // 2)
+    await user_manager.mark_alerts_sent([alert['id'] for alert in pending])
+
+
+async def run(readers: int, sweeps: int, users: int, per_user: int, alerts_per_sweep: int, pool_size: int) -> bool:
+    db_path = os.path.join(tempfile.mkdtemp(prefix="price_tracker_stress_"), "stress.db")
+    user_manager = AsyncUserManager(db_path, readers=pool_size)
+    keys = [(user_id, f"Product {n} for user {user_id}")
+            for user_id in range(1, users + 1) for n in range(per_user)]
+    await user_manager.add_trackings({'user_id': user_id, 'product_name': name, 'target_price': 0.0}
+                                     for user_id, name in keys)
+
+    done = asyncio.Event()
+    tasks = [Reader(user_manager, users, per_user) for _ in range(readers)]
+    running = [asyncio.create_task(reader.run(done)) for reader in tasks]
+    write_errors = []
+    started = time.perf_counter()
+    try:
+        for number in range(1, sweeps + 1):
+            try:
+                await sweep(user_manager, number, keys, alerts_per_sweep)
+            except Exception as e:
+                write_errors.append(f"sweep {number} failed: {e!r}")
+    finally:
+        done.set()
+        await asyncio.gather(*running)
+    elapsed = time.perf_counter() - started
+
+    final = {item.target_price for user_id in range(1, users + 1)
+             for item in await user_manager.get_tracked_items(user_id)}
+    user_manager.close()
+
+    errors = write_errors + [error for reader in tasks for error in reader.errors]
+    if final != {float(sweeps)}:
+        errors.append(f"after the last sweep trackings are at {sorted(final)}, expected {float(sweeps)}")
+    latencies = sorted(latency for reader in tasks for latency in reader.latencies)
+    reads = sum(reader.reads for reader in tasks)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else 0.0
+    print(f"{readers} readers, {sweeps} sweeps over {len(keys)} trackings in {elapsed:.1f}s: "
+          f"{reads} reads ({reads / elapsed:.0f}/s), read p99 {p99:.1f} ms")
+    for error in errors[:20]:
+        print(f"  {error}")
+    print(f"{len(errors)} errors")
+    return not errors and reads > 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=64, help="concurrent reader tasks")
+    parser.add_argument("--sweeps", type=int, default=20, help="write rounds to run while they read")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--per-user", type=int, default=20, help="trackings per user")
+    parser.add_argument("--alerts", type=int, default=100, help="alerts queued per sweep")
+    parser.add_argument("--pool-size", type=int, default=int(os.getenv("DB_READERS", "4")),
+                        help="read-only connections in the pool")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    ok = asyncio.run(run(args.readers, args.sweeps, args.users, args.per_user, args.alerts, args.pool_size))
+    sys.exit(0 if ok else 1)
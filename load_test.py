@@ -0,0 +1,221 @@
+"""
+Load-test harness: drives simulated /track conversations through Application.process_update.
+
+Every conversation goes /track -> category -> ... -> price -> "Confirm" callback, with the
+Telegram Bot API answered by an in-process fake and Rainforest replaced by a stub, so it
+measures the bot itself (handlers, state machine, database) rather than the network.
+The typing/"thinking" delays in the handlers are skipped unless --keep-delays is given.
+
+    python load_test.py --levels 10 100 1000 --api-latency 0.2
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import resource
+import tracemalloc
+from itertools import count
+from typing import List, Optional
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import main
+from models import SearchResult
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "PriceTrackerBot", "username": "price_tracker_bot"}
+
+# The answers each simulated user gives, per category, after /track
+CONVERSATIONS = {
+    "Phones": ["Phones", "iPhone 14", "Apple", "Pro Max", "256 GB", "1099"],
+    "Laptops": ["Laptops", "Lenovo", "Legion 7", "32 GB", "1 TB SSD", "AMD Ryzen 9", "2499"],
+    "Gaming": ["Gaming", "PS5 Console", "Sony", "549"],
+    "Headphones": ["Headphones", "WH-1000XM5", "Sony", "399"],
+    "TVs": ["TVs", "OLED C3 55", "LG", "1499"],
+    "Cameras": ["Cameras", "Alpha a7 IV", "Sony", "2999"],
+}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers every Bot API call locally with a minimal, well-formed response"""
+
+    def __init__(self):
+        self.calls = 0
+        self._message_ids = count(1)
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint in ("sendMessage", "sendPhoto", "editMessageText"):
+            chat_id = params.get("chat_id", 0)
+            result = {"message_id": next(self._message_ids), "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER,
+                      "text": params.get("text") or params.get("caption") or ""}
+        else:
+            # sendChatAction, answerCallbackQuery, ...
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class StubRainforest:
+    """Returns one matching product for any onboarding search after `latency` seconds"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def search_product(self, category, answers, amazon_domain, limit=10, query=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        query = query or category.build_query(answers)
+        title = f"{query} (Renewed)"
+        result = SearchResult(asin="B0TEST", title=title, tokens=(), price=499.99, currency="CAD",
+                              link="https://www.amazon.ca/dp/B0TEST", image=None,
+                              marketplace=amazon_domain, match_score=1.0)
+        return [result], query
+
+
+class _NoDelayAsyncio:
+    """Stands in for the asyncio module inside main.py so the handlers' UX delays don't count"""
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+    @staticmethod
+    async def sleep(delay, result=None):
+        return await asyncio.sleep(0, result)
+
+
+class Conversation:
+    def __init__(self, bot, user_id: int, category: str):
+        self.bot = bot
+        self.user_id = user_id
+        self.category = category
+        self._update_ids = count(user_id * 100)
+
+    def _user(self):
+        return {"id": self.user_id, "is_bot": False, "first_name": f"user{self.user_id}"}
+
+    def _message(self, text: str) -> dict:
+        message = {"message_id": next(self._update_ids), "date": int(time.time()),
+                   "chat": {"id": self.user_id, "type": "private"}, "from": self._user(), "text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return message
+
+    def updates(self):
+        yield {"update_id": next(self._update_ids), "message": self._message("/track")}
+        for answer in CONVERSATIONS[self.category]:
+            yield {"update_id": next(self._update_ids), "message": self._message(answer)}
+        yield {"update_id": next(self._update_ids), "callback_query": {
+            "id": str(next(self._update_ids)), "from": self._user(), "chat_instance": str(self.user_id),
+            "data": "confirm", "message": self._message("confirm?")}}
+
+    async def run(self, application: Application, latencies: List[float]):
+        for data in self.updates():
+            update = Update.de_json(data, application.bot)
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def run_level(bot, concurrency: int, first_user_id: int) -> dict:
+    categories = list(CONVERSATIONS)
+    conversations = [Conversation(bot, first_user_id + n, categories[n % len(categories)])
+                     for n in range(concurrency)]
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(c.run(bot.application, latencies) for c in conversations))
+    elapsed = time.perf_counter() - started
+    saved = 0
+    for conversation in conversations:
+        saved += len(await bot.user_manager.get_tracked_items(conversation.user_id))
+    return {
+        "concurrency": concurrency,
+        "updates": len(latencies),
+        "updates_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "saved": saved,
+    }
+
+
+async def run(levels: List[int], api_latency: float, keep_delays: bool, trace_memory: bool):
+    if not keep_delays:
+        main.asyncio = _NoDelayAsyncio()
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:LOAD-TEST")
+    os.environ.setdefault("RAINFOREST_API_KEY", "load-test")
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="price_tracker_load_"), "load.db")
+
+    request = FakeTelegramRequest()
+    application = (Application.builder().token(os.environ["TELEGRAM_TOKEN"])
+                   .request(request).get_updates_request(FakeTelegramRequest()).build())
+    rainforest = StubRainforest(api_latency)
+    bot = main.PriceTrackerBot(application=application, rainforest=rainforest)
+    await application.initialize()
+
+    if trace_memory:
+        tracemalloc.start()
+    print(f"{'users':>7} {'updates':>8} {'upd/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'saved':>6} {'mem MB':>8}")
+    first_user_id = 1000
+    try:
+        for concurrency in levels:
+            if trace_memory:
+                tracemalloc.reset_peak()
+            stats = await run_level(bot, concurrency, first_user_id)
+            first_user_id += concurrency
+            if trace_memory:
+                memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            else:
+                memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"{stats['concurrency']:>7} {stats['updates']:>8} {stats['updates_per_s']:>9.0f} "
+                  f"{stats['p50_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['saved']:>6} {memory:>8.1f}")
+    finally:
+        await application.shutdown()
+        bot.user_manager.close()
+
+    print("\nSlowest handlers / tracking stages (p99):")
+    for key, calls, p50, p99, slowest in bot.handler_latency.summary()[:10]:
+        print(f"  {key:<40} {calls:>7} calls  p50 {p50:7.1f} ms  p99 {p99:7.1f} ms")
+    print(f"\nBot API calls answered: {request.calls}, Rainforest searches: {rainforest.calls}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[10, 100, 1000],
+                        help="number of simultaneous conversations to run, one level after another")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="seconds the stubbed Rainforest search takes")
+    parser.add_argument("--keep-delays", action="store_true",
+                        help="keep the handlers' typing delays (asyncio.sleep) instead of skipping them")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="report tracemalloc peak per level instead of process max RSS (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args.levels, args.api_latency, args.keep_delays, args.trace_memory))
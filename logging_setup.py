@@ -0,0 +1,89 @@
+import json
+import atexit
+import queue
+import random
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Attributes every LogRecord has; anything else on a record came from `extra=` and is a field
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with `severity` so Cloud Run's log ingestion picks up the level.
+    Fields passed as `extra={...}` are added as top-level keys.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that queues the record untouched. The stdlib one formats the message and
+    traceback on the logging thread (here, the event loop) and drops exc_info; this leaves
+    both to the listener's formatter. Only safe for an in-process queue.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class DebugSampler(logging.Filter):
+    """Lets through only `rate` of DEBUG records; INFO and above always pass"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+def setup_logging(level: str = "INFO", json_format: bool = False, log_file: Optional[str] = None,
+                  debug_sample_rate: float = 0.01) -> QueueListener:
+    """
+    Route all logging through a queue so the event loop only ever enqueues records;
+    formatting and writing to stderr/the log file happen on the listener's thread.
+    Per-item DEBUG records are sampled at `debug_sample_rate` before they are queued.
+    """
+    formatter = JsonFormatter() if json_format else logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(debug_sample_rate))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+    # httpx logs every Telegram poll at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,59 +1,140 @@
 import os
 import re
+import time
 import random
 import asyncio
 import logging
-import sqlite3
+import textwrap
+import functools
+from collections import OrderedDict
 from re import search
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from typing import Optional, Dict, List
 from fuzzywuzzy import process, fuzz
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, Message
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    ReplyKeyboardMarkup,
+    Message,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent
+)
 from telegram.constants import ChatAction
+from telegram.error import TelegramError, Forbidden, BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     ContextTypes,
     filters
 )
 import requests
-from rainforest_api import RainforestAPI
-from user_manager import UserManager
-
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
+from rainforest_api import RainforestAPI, CircuitOpenError, MARKETPLACES, DEFAULT_MARKETPLACE, parse_currency_rates
+from categories import get_category, infer_category
+from async_user_manager import AsyncUserManager
+from models import Alert, KnownProduct, Tracking
+from logging_setup import setup_logging
+from metrics import LatencyStats, SweepProfiler, NULL_PROFILER
+from budget import CreditPlanner, month_bounds
+from rainforest_batch import BatchError, make_batch_runner
+from scheduler import TimingWheel
+from analytics import PriceAnalytics
+from media_cache import FileIdCache
+from product_index import ProductIndex
+from supervisor import TaskSupervisor, serve_health
+
+MARKETPLACE_ALIASES = {
+    "ca": "amazon.ca",
+    "us": "amazon.com",
+    "uk": "amazon.co.uk",
+}
+
+# /track "PlayStation 5" 499.99 (quotes optional, straight or curly; a leading $ is fine)
+QUICK_TRACK = re.compile(r'^\s*["“”\']?(?P<name>.+?)["“”\']?\s+\$?(?P<price>\d+(?:\.\d{1,2})?)\s*$')
 
 def normalize(text: str) -> str:
     return re.sub(r"[^a-z0-9]", "", text.lower())
 
 class PriceTrackerBot:
-    def __init__(self):
-        os.makedirs("/var/data", exist_ok=True)
+    # How many search results the confirm step offers, and how many per page of "Other matches"
+    MAX_CANDIDATES = 12
+    CANDIDATES_PER_PAGE = 4
+    # Price sweeps save their progress (alerts and checked trackings) every this many queries
+    CHECKPOINT_EVERY = 20
+    # Each interval's checks are spread over this many ticks of the timing wheel
+    WHEEL_SLOTS = 60
+    BATCH_WHEEL_SLOTS = 6
+    # Inline answers kept for repeated queries, and how many products one answer lists
+    INLINE_CACHE_SIZE = 512
+    INLINE_RESULTS = 20
+    # Telegram rejects messages over 4096 characters; leave room for a prefix
+    TELEGRAM_MESSAGE_LIMIT = 4000
+
+    def __init__(self, application: Optional[Application] = None, rainforest: Optional[RainforestAPI] = None):
+        """`application` and `rainforest` can be passed in to run the bot against fakes (see load_test.py)"""
         load_dotenv()
+        db_path = os.getenv("DB_PATH", "/var/data/price_tracker.db")
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
         self.rainforest_api_key = os.getenv("RAINFOREST_API_KEY")
         self.token = os.getenv("TELEGRAM_TOKEN")
+        self.default_marketplaces = [
+            m.strip() for m in os.getenv("MARKETPLACES", DEFAULT_MARKETPLACE).split(",")
+            if m.strip() in MARKETPLACES
+        ] or [DEFAULT_MARKETPLACE]
 
         if not self.token or not self.rainforest_api_key:
             raise ValueError("Missing required environment variables")
 
-        self.db_conn = sqlite3.connect("/var/data/price_tracker.db")
-        self.user_manager = UserManager(self.db_conn)
-        self.rainforest = RainforestAPI(self.rainforest_api_key)
-        self.application = Application.builder().token(self.token).build()
+        self.user_manager = AsyncUserManager(db_path, readers=int(os.getenv("DB_READERS", "4")))
+        self.rainforest = rainforest or RainforestAPI(self.rainforest_api_key,
+                                                      max_pages=int(os.getenv("RAINFOREST_MAX_PAGES", "3")),
+                                                      currency_rates=parse_currency_rates(os.getenv("CURRENCY_RATES")))
+        self.application = application or Application.builder().token(self.token).build()
+        self.admin_user_ids = {int(u) for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip().isdigit()}
+        self.handler_latency = LatencyStats()
+        # PROFILE_SWEEP=1 profiles every sweep; /profile profiles just the next one
+        self.profile_every_sweep = os.getenv("PROFILE_SWEEP") == "1"
+        self.profile_dump_path = os.getenv("PROFILE_SWEEP_DUMP")
+        self._profile_requested_by = set()
+        self.sweep_interval = 3600
+        # RAINFOREST_BATCH=collections submits a sweep's queries as batch jobs instead of one request each
+        self.batch_runner = make_batch_runner(os.getenv("RAINFOREST_BATCH", "off"), self.rainforest)
+        # A collection job takes minutes of polling, so in batch mode the wheel turns in fewer,
+        # longer ticks, each gathering enough queries to be worth one job and finishing within it
+        self.wheel = TimingWheel(self.sweep_interval,
+                                 self.BATCH_WHEEL_SLOTS if self.batch_runner else self.WHEEL_SLOTS)
+        # Restarts the checker if it dies, or stalls CHECKER_STALL_SECONDS behind its schedule
+        self.checker = TaskSupervisor("Price checker", self._start_price_checks,
+                                      stall_after=float(os.getenv("CHECKER_STALL_SECONDS", "1800")))
+        # With a MONTHLY_CREDIT_BUDGET, each tick only checks as many queries as the budget allows
+        credit_budget = int(os.getenv("MONTHLY_CREDIT_BUDGET", "0"))
+        self.credit_planner = None
+        if credit_budget > 0:
+            # Planned per tick, but no query comes up more than once a rotation
+            self.credit_planner = CreditPlanner(credit_budget, self.wheel.tick, min_interval=self.wheel.interval)
+        self.prefetch_delay = float(os.getenv("PREFETCH_DELAY", "2"))
+        self.analytics = PriceAnalytics(self.user_manager, window_days=float(os.getenv("STATS_WINDOW_DAYS", "90")))
+        # Product photos are sent by file_id once Telegram has fetched them from Amazon
+        self.file_ids = FileIdCache(self.user_manager, capacity=int(os.getenv("MEDIA_CACHE_SIZE", "5000")))
+        # Inline mode (@bot ps5) answers from listings seen in earlier searches, never a live search
+        self.product_index = ProductIndex(capacity=int(os.getenv("PRODUCT_INDEX_SIZE", "20000")))
+        self._product_index_loaded = False
+        self._product_index_lock = asyncio.Lock()
+        self.inline_debounce = float(os.getenv("INLINE_DEBOUNCE", "0.3"))
+        self._inline_latest = {}
+        self._inline_cache = OrderedDict()
 
         self._register_handlers()
         self._setup_logging()
 
     def _setup_logging(self):
+        # Handlers live on the root logger's queue listener (see logging_setup), not here
         self.logger = logging.getLogger(__name__)
-        file_handler = logging.FileHandler("price_tracker.log")
-        formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-        file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
 
     def _register_handlers(self):
         handlers = [
@@ -62,13 +143,22 @@ class PriceTrackerBot:
             CommandHandler("stop", self._handle_stop),
             CommandHandler("list", self._handle_list),
             CommandHandler("help", self._handle_help),
+            CommandHandler("markets", self._handle_markets),
+            CommandHandler("stats", self._handle_stats),
+            CommandHandler("profile", self._handle_profile),
+            CommandHandler("credits", self._handle_credits),
+            CallbackQueryHandler(self._handle_stop_choice, pattern=r"^stop:"),
+            CallbackQueryHandler(self._handle_candidate_choice, pattern=r"^cand:"),
             CallbackQueryHandler(self._handle_confirmation),
+            # Non-blocking so the debounce wait doesn't hold up other updates
+            InlineQueryHandler(self._handle_inline_query, block=False),
             CommandHandler("cancel", self._handle_cancel),
             MessageHandler(filters.TEXT & ~filters.COMMAND, self._handle_message),
             MessageHandler(filters.COMMAND, self._handle_unknown_command)
         ]
 
         for handler in handlers:
+            handler.callback = self._timed(self._handler_label(handler), handler.callback)
             self.application.add_handler(handler)
         self.application.add_error_handler(self._handle_error)
 
@@ -78,13 +168,97 @@ class PriceTrackerBot:
             "Type /help to see what I can do."
         )
 
-    def _parse_price(self, price_str):
-        if price_str:
+    async def _user_marketplaces(self, user_id: int) -> List[str]:
+        return await self.user_manager.get_marketplaces(user_id) or self.default_marketplaces
+
+    @staticmethod
+    def _handler_label(handler) -> str:
+        if isinstance(handler, CommandHandler):
+            return "/" + sorted(handler.commands)[0]
+        return handler.callback.__name__.lstrip("_")
+
+    def _timed(self, label: str, callback):
+        """Wrap a handler callback to record its wall time, per handler and per tracking_stage"""
+        @functools.wraps(callback)
+        async def timed(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            stage = context.user_data.get('tracking_stage') if context.user_data is not None else None
+            started = time.perf_counter()
             try:
-                return float(price_str.replace("$", "").replace(",", "").strip())
-            except Exception:
-                return None
-        return None
+                return await callback(update, context)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.handler_latency.record(label, elapsed)
+                if stage:
+                    self.handler_latency.record(f"stage:{stage}", elapsed)
+        return timed
+
+    async def _handle_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin only: show handler latencies and profile the next price-check sweep"""
+        user_id = update.effective_user.id
+        if user_id not in self.admin_user_ids:
+            await self._handle_unknown_command(update, context)
+            return
+        self._profile_requested_by.add(user_id)
+        rows = self.handler_latency.summary()
+        lines = [f"{key}: {calls} calls, p50 {p50:.0f} ms, p99 {p99:.0f} ms, max {slowest:.0f} ms"
+                 for key, calls, p50, p99, slowest in rows[:20]]
+        await update.message.reply_text(
+            "⏱ Handler latency (slowest p99 first):\n" + ("\n".join(lines) or "No calls yet") +
+            "\n\nThe next price-check sweep will be profiled and the report sent here."
+        )
+
+    async def _handle_credits(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin only: Rainforest credits spent this month and where the month is heading"""
+        if update.effective_user.id not in self.admin_user_ids:
+            await self._handle_unknown_command(update, context)
+            return
+        await self._flush_api_calls(self.rainforest.drain_ledger())
+        now = datetime.now()
+        month_start, _ = month_bounds(now)
+        usage = await self.user_manager.get_credit_usage(month_start.isoformat())
+        used = sum(usage.values())
+        lines = [f"💳 Credits used this month: {used}"]
+        lines += [f"• {purpose}: {credits}" for purpose, credits in sorted(usage.items())]
+        if self.rainforest.credits_remaining is not None:
+            lines.append(f"Rainforest reports {self.rainforest.credits_remaining} credits remaining")
+        if self.credit_planner:
+            planner = self.credit_planner
+            candidates = [(key, len(group), len(key[2]))
+                          for key, group in self._group_trackings(await self.user_manager.get_all_trackings())]
+            interval = planner.check_interval(candidates, used, now)
+            lines += [
+                f"Budget: {planner.monthly_budget}, projected month-end: {planner.projected_usage(used, now):.0f}",
+                f"Allowance per {self.wheel.tick:.0f}s tick: {planner.sweep_allowance(used, now):.1f}",
+                f"Each query checked every {interval}" if interval else "Budget spent: sweeps are paused",
+            ]
+        else:
+            lines.append("No MONTHLY_CREDIT_BUDGET set: every sweep checks every query")
+        await update.message.reply_text("\n".join(lines))
+
+    async def _handle_markets(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        available = ", ".join(f"{alias} ({domain})" for alias, domain in MARKETPLACE_ALIASES.items())
+        if not context.args:
+            current = ", ".join(await self._user_marketplaces(user_id))
+            await update.message.reply_text(
+                f"🌍 You're searching: {current}\n\n"
+                f"Available: {available}\n"
+                "Change with e.g. /markets ca us — the first one is your home store and currency."
+            )
+            return
+        marketplaces = []
+        for arg in context.args:
+            domain = MARKETPLACE_ALIASES.get(arg.lower(), arg.lower())
+            if domain not in MARKETPLACES:
+                await update.message.reply_text(f"❌ Unknown marketplace: {arg}\nAvailable: {available}")
+                return
+            if domain not in marketplaces:
+                marketplaces.append(domain)
+        await self.user_manager.set_marketplaces(user_id, marketplaces)
+        await update.message.reply_text(
+            f"✅ New trackings will search {', '.join(marketplaces)} "
+            f"(prices in {MARKETPLACES[marketplaces[0]]})."
+        )
 
     def escape_markdown(self, text: str) -> str:
         escape_chars = r'\_*[]()~`>#+-=|{}.!'
@@ -106,6 +280,13 @@ class PriceTrackerBot:
         await update.message.reply_text(help_text)
 
     async def _handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Deep links from inline results: /start trk_<asin> tracks that listing, /start track starts /track
+        if context.args and context.args[0].startswith("trk_"):
+            await self._start_known_product(update, context, context.args[0][len("trk_"):])
+            return
+        if context.args and context.args[0] == "track":
+            await self._start_guided_tracking(update, context)
+            return
         user_first_name = update.effective_user.first_name
         await asyncio.sleep(1.5)
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
@@ -123,10 +304,58 @@ class PriceTrackerBot:
         )
 
     async def _start_advanced_tracking(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if context.args and context.args != ["advanced"]:
+            match = QUICK_TRACK.match(update.message.text.split(None, 1)[1])
+            if not match:
+                await self._show_track_help(update, context)
+                return
+            await self._quick_track(update, context, match["name"].strip(), float(match["price"]))
+            return
+        await self._start_guided_tracking(update, context)
+
+    async def _start_guided_tracking(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         await asyncio.sleep(1)
         await self._ask_for_category(update, context)
 
+    async def _quick_track(self, update: Update, context: ContextTypes.DEFAULT_TYPE, product_name: str,
+                           target_price: float):
+        """/track "Name" price: infer the category, search and show the confirm card in one step"""
+        # Whatever happens next, a half-finished guided flow (and its prefetch) is abandoned
+        self._cancel_prefetch(context)
+        context.user_data.clear()
+        category = infer_category(product_name)
+        if category is None:
+            await update.message.reply_text(
+                f"🤔 I couldn't tell what kind of product \"{product_name}\" is, so let's set it up step by step.")
+            await self._ask_for_category(update, context)
+            return
+        context.user_data.update({'category': category.name, 'product_name': product_name,
+                                  'target_price': target_price})
+        marketplace = (await self._user_marketplaces(update.effective_user.id))[0]
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        try:
+            results, search_query = await asyncio.to_thread(
+                self.rainforest.search_product, category, {}, marketplace, None, product_name)
+        except CircuitOpenError:
+            # Nothing to resume here, unlike the guided flow: the user resends the command
+            context.user_data.clear()
+            await update.message.reply_text(
+                "⚠️ Product search is temporarily unavailable.\n"
+                "Send the same /track command again in a few minutes to retry.")
+            return
+        if not results:
+            context.user_data.clear()
+            await update.message.reply_text(
+                f"❌ No {category.name.lower()} matching \"{product_name}\" found on {marketplace}.\n"
+                "Try a more exact name, or /track on its own for the guided search.")
+            return
+        await self._remember_products(results, category, search_query)
+        context.user_data["candidates"] = self._rank_candidates(results)
+        context.user_data["search_query"] = search_query
+        context.user_data["tracking_stage"] = "end_conversation"
+        await self._send_candidate_card(update.effective_chat.id, context, 0, pace=False)
+
     async def _handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         stage = context.user_data.get('tracking_stage')
         if stage == 'awaiting_category':
@@ -140,14 +369,10 @@ class PriceTrackerBot:
                     "For example: iPhone 14, Galaxy S23, Pixel 8 Pro"
                 )
                 context.user_data['tracking_stage'] = 'awaiting_mobile_name'
-            elif user_input == "Headphones":
-                await self._handle_unimplemented_category(user_input, update, context)
             elif user_input == "Laptops":
                 await self._ask_for_laptop_manufacturer(update, context)
-            elif user_input == "TVs":
-                await self._handle_unimplemented_category(user_input, update, context)
-            elif user_input == "Cameras":
-                await self._handle_unimplemented_category(user_input, update, context)
+            elif get_category(user_input) and get_category(user_input).spec.name_prompt:
+                await self._ask_for_product_name(update, context, get_category(user_input))
             elif user_input == "Gaming":
                 await asyncio.sleep(1.5)
                 await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
@@ -171,6 +396,12 @@ class PriceTrackerBot:
                         one_time_keyboard=True
                     )
                 )
+        elif stage == 'awaiting_product_name':
+            context.user_data['product_name'] = update.message.text
+            await self._ask_for_manufacturer(update, context, get_category(context.user_data.get('category')))
+        elif stage == 'awaiting_manufacturer':
+            context.user_data['manufacturer_name'] = update.message.text
+            await self._ask_for_price(update, context)
         elif stage == "awaiting_mobile_name":
             context.user_data['product_name'] = update.message.text
             await self._ask_for_mobile_manufacturer(update, context)
@@ -208,11 +439,7 @@ class PriceTrackerBot:
             try:
                 target_price = float(update.message.text)
                 context.user_data['console_target_price'] = target_price
-                await self._confirm_console_product_search(update, context, context.user_data['category'],
-                                                          context.user_data['product_name'],
-                                                          context.user_data["gaming_manufacturer_name"],
-                                                          context.user_data['console_target_price']
-                                                          )
+                await self._confirm_product_search(update, context)
             except ValueError:
                 await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
                 await asyncio.sleep(1.2)
@@ -221,13 +448,7 @@ class PriceTrackerBot:
             try:
                 target_price = float(update.message.text)
                 context.user_data['mobile_target_price'] = target_price
-                await self._confirm_mobile_product_search(update, context, context.user_data['category'],
-                                                          context.user_data['product_name'],
-                                                          context.user_data["mobile_manufacturer_name"],
-                                                          context.user_data["model_name"],
-                                                          context.user_data["mobile_storage"],
-                                                          context.user_data['mobile_target_price']
-                                                          )
+                await self._confirm_product_search(update, context)
             except ValueError:
                 await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
                 await asyncio.sleep(1.2)
@@ -236,26 +457,29 @@ class PriceTrackerBot:
             try:
                 target_price1 = float(update.message.text)
                 context.user_data['laptop_target_price'] = target_price1
-                await self._confirm_laptop_product_search(update, context,
-                                                          context.user_data['category'],
-                                                          context.user_data['product_name'],
-                                                          context.user_data["laptop_manufacturer_name"],
-                                                          context.user_data["laptop_ram"],
-                                                          context.user_data["laptop_storage"],
-                                                          context.user_data["laptop_processor"],
-                                                          context.user_data["laptop_target_price"]
-                                                          )
+                await self._confirm_product_search(update, context)
             except ValueError:
                 await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
                 await asyncio.sleep(1.2)
                 await update.message.reply_text("❌ Invalid price! Please enter a valid number:")
+        elif stage == 'known_product_price':
+            # Not an awaiting_* stage: the listing is already known, so there is nothing to prefetch
+            try:
+                target_price = float(update.message.text)
+            except ValueError:
+                await update.message.reply_text("❌ Invalid price! Please enter a valid number:")
+            else:
+                context.user_data['target_price'] = target_price
+                await self._save_advanced_tracking(update, context)
+                product_name = context.user_data.get('product_name')
+                context.user_data.clear()
+                await update.message.reply_text(
+                    f"✅ Tracking {product_name}. I'll let you know when it's at or below {target_price:.2f}.")
         elif stage == 'awaiting_price':
             try:
                 target_price = float(update.message.text)
                 context.user_data['target_price'] = target_price
-                await self._confirm_product_search(update, context,
-                                                   context.user_data['product_name'],
-                                                   context.user_data.get('category'))
+                await self._confirm_product_search(update, context)
             except ValueError:
                 await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
                 await asyncio.sleep(1.2)
@@ -269,6 +493,88 @@ class PriceTrackerBot:
                 "You can try `/help` to see available commands"
             )
             # await self._handle_help(update, context)
+        await self._prefetch_search(update, context)
+
+    async def _prefetch_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Start the product search in the background while the user types their target price,
+        so the confirm step can usually show the result straight away. Only the price prompt
+        qualifies: no answer after it changes the query, so a prefetch never searches for a
+        query the user is still refining. It waits `prefetch_delay` first, so a price sent
+        straight away (or /cancel) doesn't cost a second call.
+        """
+        stage = context.user_data.get('tracking_stage', '')
+        if not (stage.startswith('awaiting_') and stage.endswith('_price')):
+            return
+        category = get_category(context.user_data.get('category'))
+        query = category.build_query(context.user_data) if category else None
+        if not query:
+            return
+        marketplace = (await self._user_marketplaces(update.effective_user.id))[0]
+        current = context.user_data.get('prefetch')
+        if current and current['query'] == query and current['marketplace'] == marketplace:
+            return
+        self._cancel_prefetch(context)
+        answers = dict(context.user_data)
+
+        async def search():
+            await asyncio.sleep(self.prefetch_delay)
+            return await asyncio.to_thread(self.rainforest.search_product, category, answers, marketplace)
+
+        task = asyncio.create_task(search())
+        # Retrieve a failed prefetch's exception so asyncio doesn't log it; confirm searches again
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        context.user_data['prefetch'] = {'query': query, 'marketplace': marketplace, 'task': task}
+
+    def _cancel_prefetch(self, context: ContextTypes.DEFAULT_TYPE):
+        prefetch = context.user_data.pop('prefetch', None)
+        if prefetch:
+            prefetch['task'].cancel()
+
+    async def _search_for_confirmation(self, context: ContextTypes.DEFAULT_TYPE, category, marketplace):
+        """(results, search query) for the confirm step, from the prefetch when it searched the same thing"""
+        prefetch = context.user_data.pop('prefetch', None)
+        query = category.build_query(context.user_data) if category else None
+        if prefetch and prefetch['query'] == query and prefetch['marketplace'] == marketplace:
+            try:
+                return await prefetch['task']
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"Prefetched search failed, searching again: {e}")
+        elif prefetch:
+            prefetch['task'].cancel()
+        return await asyncio.to_thread(self.rainforest.search_product, category, dict(context.user_data), marketplace)
+
+    async def _ask_for_product_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE, category):
+        await asyncio.sleep(1.5)
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        await update.message.reply_text(category.spec.name_prompt)
+        context.user_data['tracking_stage'] = 'awaiting_product_name'
+
+    async def _ask_for_manufacturer(self, update: Update, context: ContextTypes.DEFAULT_TYPE, category):
+        choose = [["Skip Manufacturer"]]
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        await asyncio.sleep(1.2)
+        await update.message.reply_text(
+            category.spec.manufacturer_prompt,
+            reply_markup=ReplyKeyboardMarkup(
+                choose,
+                one_time_keyboard=True,
+                resize_keyboard=True
+            )
+        )
+        context.user_data['tracking_stage'] = 'awaiting_manufacturer'
+
+    async def _ask_for_price(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        randint = random.randint(150, 900)
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        await asyncio.sleep(1.2)
+        await update.message.reply_text(
+            "💵 Enter your target price:\n"
+            f"Example: {randint}.99"
+        )
+        context.user_data['tracking_stage'] = 'awaiting_price'
 
     async def _ask_for_mobile_manufacturer(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         choose = [["Skip Manufacturer"]]
@@ -545,25 +851,18 @@ class PriceTrackerBot:
         )
         context.user_data['tracking_stage'] = 'awaiting_category'
 
-    async def _handle_unimplemented_category(self, user_input, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        randint = random.randint(0, 3)
-        friendly_responses = [
-            f"Oops! I’m not tracking products in the *{user_input}* category just yet.",
-            f"Thanks for your interest in *{user_input}* — I'm working on adding support for that soon!",
-            f"*{user_input}* is not available at the moment, but it's on my radar!",
-            f"I'm not tracking *{user_input}* yet, but stay tuned — it's coming!"
-        ]
-        support_note = "\n\nIf you like this bot and want to support what I do, you can [buy me a coffee](https://buymeacoffee.com/yiosa)."
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-        await asyncio.sleep(3)
-        await update.message.reply_text(friendly_responses[randint] + support_note)
-        await self._ask_for_category(update, context)
-
-    async def _confirm_console_product_search(self, update, context, category, product_name, manufacturer, target):
+    async def _confirm_product_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        category = get_category(context.user_data.get("category"))
+        product_name = context.user_data.get("product_name")
+        home_marketplace = (await self._user_marketplaces(update.effective_user.id))[0]
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         await asyncio.sleep(1)
         await context.bot.send_message(chat_id=update.effective_chat.id, text="🔍 Searching for the best match...")
-        results, search_query = self.rainforest._search_console_product(category, product_name, manufacturer)
+        try:
+            results, search_query = await self._search_for_confirmation(context, category, home_marketplace)
+        except CircuitOpenError:
+            await self._handle_search_unavailable(update, context)
+            return
         if not results:
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             await asyncio.sleep(2)
@@ -577,210 +876,222 @@ class PriceTrackerBot:
                 parse_mode="Markdown"
             )
             await self._handle_cancel(update, context)
-            await self._start_advanced_tracking(update, context)
+            await self._start_guided_tracking(update, context)
             return
         else:
-            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_photo")
-            await asyncio.sleep(1.5)
-            selected_product = results[0]
-            found_product_name = selected_product.get("title")
-            escaped_name = self.escape_markdown(found_product_name)
-            price = self._parse_price(selected_product.get("price", {}).get("raw"))
-            image_url = selected_product.get("image")
-            keyboard = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("✅ Confirm", callback_data="confirm"),
-                    InlineKeyboardButton("❌ Cancel Search", callback_data="cancel_search")
-                ]
-            ])
-            caption = (
-                f"🛒 *Product:* {escaped_name}\n"
-                f"💰 *Current Price:* {self.escape_markdown(f'${price}')}\n\n"
-                "✅ *I'll use these details to track this item\\.*\n"
-                "❌ *If this is NOT the product you meant, click below or type* `/cancel` *to stop\\.*"
-            )
-            if image_url:
-                try:
-                    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_photo")
-                    await asyncio.sleep(2)
-                    await update.message.reply_photo(
-                        photo=image_url,
-                        caption=caption,
-                        parse_mode="MarkdownV2",
-                        reply_markup=keyboard
-                    )
-                except Exception as e:
-                    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-                    await asyncio.sleep(1)
-                    await update.message.reply_text(
-                        f"✅ *Found:* {found_product_name}\n"
-                        f"💰 *Price:* ${price}\n"
-                        "✅ *Tracking will start.*\n"
-                        "❌ *If this is not correct, type* `/cancel`.",
-                        parse_mode="MarkdownV2"
-                    )
-            else:
-                await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-                await asyncio.sleep(1.2)
-                await update.message.reply_text(
-                    f"✅ *Found:* {found_product_name}\n"
-                    f"💰 *Current Price:* {self.escape_markdown(f'${price}')}\n\n"
-                    "✅ *Tracking will start.*\n"
-                    "❌ *If this is not correct, type* `/cancel`.",
-                    parse_mode="MarkdownV2"
-                )
+            await self._remember_products(results, category, search_query)
+            # Keep the best few so "Other matches" can page through them without searching again
+            context.user_data["candidates"] = self._rank_candidates(results)
+            await self._send_candidate_card(update.effective_chat.id, context, 0)
             context.user_data["search_query"] = search_query
             context.user_data["tracking_stage"] = "end_conversation"
 
-    async def _confirm_laptop_product_search(self, update, context, category, product_name, manufacturer, ram, storage,
-                                             processor, target_price):
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-        await asyncio.sleep(1)
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="🔍 Searching for the best match...")
-        results, search_query = self.rainforest._search_laptop_product(category, product_name, manufacturer,
-                                                                       ram, storage, processor, target_price)
-        if not results:
-            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-            await asyncio.sleep(2)
-            await update.message.reply_text(
-                f"❌ No matching products found for *{product_name}*.\n\n"
-                "Please double-check the spelling, make sure it's a real product name, "
-                "and try again with more accurate details.\n\n"
-                "I can only search for *real products* that exist in the system."
-                "\n\nExample: 'iPhone 14 Pro Max 256GB', not just 'iPhone 14'.\n\n"
-                "Let me know when you're ready to try again!",
-                parse_mode="Markdown"
-            )
-            await self._handle_cancel(update, context)
-            await self._start_advanced_tracking(update, context)
+    async def _ensure_product_index(self):
+        async with self._product_index_lock:
+            if self._product_index_loaded:
+                return
+            # Oldest first, so the most recently seen are the last to be evicted
+            for product in reversed(await self.user_manager.get_products(self.product_index.capacity)):
+                self.product_index.add(product)
+            self._product_index_loaded = True
+
+    async def _remember_products(self, results, category, search_query: str):
+        """Add an onboarding search's listings to the inline index (and persist them)"""
+        now = time.time()
+        products = [KnownProduct(result, category.name, search_query, now)
+                    for result in results if result.asin and result.price is not None]
+        if not products:
             return
-        else:
-            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_photo")
-            await asyncio.sleep(1.5)
-            selected_product = results[0]
-            found_product_name = selected_product.get("title")
-            escaped_name = self.escape_markdown(found_product_name)
-            price = self._parse_price(selected_product.get("price", {}).get("raw"))
-            image_url = selected_product.get("image")
-            keyboard = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("✅ Confirm", callback_data="confirm"),
-                    InlineKeyboardButton("❌ Cancel Search", callback_data="cancel_search")
-                ]
-            ])
-            caption = (
-                f"🛒 *Product:* {escaped_name}\n"
-                f"💰 *Current Price:* {self.escape_markdown(f'${price}')}\n\n"
-                "✅ *I'll use these details to track this item\\.*\n"
-                "❌ *If this is NOT the product you meant, click below or type* `/cancel` *to stop\\.*"
-            )
-            if image_url:
-                try:
-                    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_photo")
-                    await asyncio.sleep(2)
-                    await update.message.reply_photo(
-                        photo=image_url,
-                        caption=caption,
-                        parse_mode="MarkdownV2",
-                        reply_markup=keyboard
-                    )
-                except Exception as e:
-                    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-                    await asyncio.sleep(1)
-                    await update.message.reply_text(
-                        f"✅ *Found:* {found_product_name}\n"
-                        f"💰 *Price:* ${price}\n"
-                        "✅ *Tracking will start.*\n"
-                        "❌ *If this is not correct, type* `/cancel`.",
-                        parse_mode="MarkdownV2"
-                    )
+        await self._ensure_product_index()
+        for product in products:
+            self.product_index.add(product)
+        await self.user_manager.save_products(products, self.product_index.capacity)
+
+    async def _handle_inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """@bot <words>: listings the bot has already seen, ranked from the local index"""
+        inline_query = update.inline_query
+        user_id = inline_query.from_user.id
+        # Telegram sends a query per keystroke: only answer the one still current after a short pause
+        self._inline_latest[user_id] = inline_query.id
+        await asyncio.sleep(self.inline_debounce)
+        if self._inline_latest.get(user_id) != inline_query.id:
+            return
+        del self._inline_latest[user_id]
+        await self._ensure_product_index()
+        results = self._inline_results(inline_query.query, context.bot.username)
+        try:
+            await inline_query.answer(
+                results, cache_time=60,
+                button=InlineQueryResultsButton(text="🔎 Not listed? Search with /track", start_parameter="track"))
+        except BadRequest as e:
+            # The user kept typing and Telegram has dropped this query
+            self.logger.debug(f"Inline answer not delivered: {e}")
+
+    def _inline_results(self, text: str, bot_username: str) -> list:
+        """Inline results for `text`, cached until the index changes"""
+        key = text.lower()
+        cached = self._inline_cache.get(key)
+        if cached and cached[0] == self.product_index.version:
+            self._inline_cache.move_to_end(key)
+            return cached[1]
+        results = [self._inline_article(product, bot_username)
+                   for product in self.product_index.search(text, self.INLINE_RESULTS)]
+        self._inline_cache[key] = (self.product_index.version, results)
+        self._inline_cache.move_to_end(key)
+        while len(self._inline_cache) > self.INLINE_CACHE_SIZE:
+            self._inline_cache.popitem(last=False)
+        return results
+
+    @staticmethod
+    def _inline_article(product: KnownProduct, bot_username: str) -> InlineQueryResultArticle:
+        result = product.result
+        price = f"{result.price:.2f} {result.currency or MARKETPLACES.get(result.marketplace, '')}".strip()
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(
+            "🔔 Track this price", url=f"https://t.me/{bot_username}?start=trk_{result.asin}")]])
+        return InlineQueryResultArticle(
+            id=result.asin,
+            title=result.title,
+            description=f"{price} on {result.marketplace}",
+            thumbnail_url=result.image,
+            input_message_content=InputTextMessageContent(
+                f"🛒 {result.title}\n💰 {price} on {result.marketplace}\n🔗 {result.link}"),
+            reply_markup=keyboard
+        )
+
+    async def _start_known_product(self, update: Update, context: ContextTypes.DEFAULT_TYPE, asin: str):
+        """Track a listing picked from inline results: only the target price is left to ask"""
+        await self._ensure_product_index()
+        product = self.product_index.get(asin)
+        if product is None:
+            await update.message.reply_text("I don't have that product on file anymore, let's look it up.")
+            await self._start_guided_tracking(update, context)
+            return
+        result = product.result
+        self._cancel_prefetch(context)
+        context.user_data.clear()
+        context.user_data.update({
+            'category': product.category,
+            'product_name': textwrap.shorten(result.title, 60, placeholder="…"),
+            'search_query': product.search_query,
+            'candidates': [result],
+            'selected_candidate': 0,
+            'tracking_stage': 'known_product_price',
+        })
+        await update.message.reply_text(
+            f"🛒 {result.title}\n"
+            f"💰 Last seen at {result.price:.2f} {result.currency or ''} on {result.marketplace}\n\n"
+            "🎯 What's your target price? Just the number, e.g. 449.99"
+        )
+
+    @classmethod
+    def _rank_candidates(cls, results) -> list:
+        """Best match first; among equally good matches, cheapest first"""
+        ranked = sorted(results, key=lambda r: (-r.match_score, r.price is None, r.price or 0.0))
+        return ranked[:cls.MAX_CANDIDATES]
+
+    async def _send_candidate_card(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE, index: int,
+                                   pace: bool = True):
+        """Show candidate `index` with Confirm/Cancel; `pace=False` skips the typing delays (quick /track)"""
+        candidates = context.user_data["candidates"]
+        selected_product = candidates[index]
+        context.user_data["selected_candidate"] = index
+        escaped_name = self.escape_markdown(selected_product.title)
+        price = selected_product.price
+        buttons = [[
+            InlineKeyboardButton("✅ Confirm", callback_data="confirm"),
+            InlineKeyboardButton("❌ Cancel Search", callback_data="cancel_search")
+        ]]
+        if len(candidates) > 1:
+            buttons.append([InlineKeyboardButton(f"🔎 Not it? See all {len(candidates)} matches",
+                                                 callback_data="cand:page:0")])
+        keyboard = InlineKeyboardMarkup(buttons)
+        caption = (
+            f"🛒 *Product:* {escaped_name}\n"
+            f"💰 *Current Price:* {self.escape_markdown(f'${price}')}\n\n"
+            "✅ *I'll use these details to track this item\\.*\n"
+            "❌ *If this is NOT the product you meant, click below or type* `/cancel` *to stop\\.*"
+        )
+        if selected_product.image:
+            try:
+                if pace:
+                    await context.bot.send_chat_action(chat_id=chat_id, action="upload_photo")
+                    await asyncio.sleep(1.5)
+                await self._send_product_photo(context.bot, chat_id, selected_product.asin, selected_product.image,
+                                               caption=caption, parse_mode="MarkdownV2", reply_markup=keyboard)
+                return
+            except TelegramError as e:
+                self.logger.warning(f"Could not send product photo: {e}")
+        if pace:
+            await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+            await asyncio.sleep(1.2)
+        await context.bot.send_message(chat_id=chat_id, text=caption, parse_mode="MarkdownV2", reply_markup=keyboard)
+
+    async def _send_product_photo(self, bot, chat_id: int, asin: Optional[str], image: str, **kwargs) -> Message:
+        """send_photo by cached file_id when Telegram already has the image, else by URL, caching the new id"""
+        file_id = await self.file_ids.get(asin, image)
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            except BadRequest as e:
+                self.logger.info(f"Cached photo for {asin or image} was rejected, sending it from the URL: {e}")
+                await self.file_ids.forget(asin, image)
+        message = await bot.send_photo(chat_id=chat_id, photo=image, **kwargs)
+        if message.photo:
+            await self.file_ids.put(asin, image, message.photo[-1].file_id)
+        return message
+
+    def _candidate_page(self, candidates, page: int):
+        """Text and keyboard for one page of the candidate list"""
+        per_page = self.CANDIDATES_PER_PAGE
+        pages = (len(candidates) + per_page - 1) // per_page
+        page = max(0, min(page, pages - 1))
+        rows = []
+        for index in range(page * per_page, min(len(candidates), (page + 1) * per_page)):
+            candidate = candidates[index]
+            price = f"${candidate.price}" if candidate.price is not None else "no price"
+            label = candidate.title if len(candidate.title) <= 40 else candidate.title[:39] + "…"
+            rows.append([InlineKeyboardButton(f"{price} · {label}", callback_data=f"cand:pick:{index}")])
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("◀️ Prev", callback_data=f"cand:page:{page - 1}"))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton("Next ▶️", callback_data=f"cand:page:{page + 1}"))
+        if navigation:
+            rows.append(navigation)
+        rows.append([InlineKeyboardButton("❌ None of these", callback_data="cancel_search")])
+        text = f"🔎 Matches (page {page + 1} of {pages}) — tap the one you meant:"
+        return text, InlineKeyboardMarkup(rows)
+
+    async def _handle_candidate_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Paging and picking among the candidates of the last search, served from user_data"""
+        query = update.callback_query
+        await query.answer()
+        candidates = context.user_data.get("candidates")
+        if not candidates:
+            await context.bot.send_message(chat_id=update.effective_chat.id,
+                                           text="⌛ That search has expired. Use /track to start a new one.")
+            return
+        _, action, value = query.data.split(":", 2)
+        index = int(value) if value.isdigit() else 0
+        if action == "page":
+            text, keyboard = self._candidate_page(candidates, index)
+            if query.message and query.message.text:
+                # Already looking at the list: flip the page in place
+                await query.edit_message_text(text, reply_markup=keyboard)
             else:
-                await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-                await asyncio.sleep(1.2)
-                await update.message.reply_text(
-                    f"✅ *Found:* {found_product_name}\n"
-                    f"💰 *Current Price:* {self.escape_markdown(f'${price}')}\n\n"
-                    "✅ *Tracking will start.*\n"
-                    "❌ *If this is not correct, type* `/cancel`.",
-                    parse_mode="MarkdownV2"
-                )
-            context.user_data["search_query"] = search_query
-            context.user_data["tracking_stage"] = "end_conversation"
+                await context.bot.send_message(chat_id=update.effective_chat.id, text=text, reply_markup=keyboard)
+        elif action == "pick" and index < len(candidates):
+            await query.edit_message_text(f"👉 {candidates[index].title}")
+            await self._send_candidate_card(update.effective_chat.id, context, index)
 
-    async def _confirm_mobile_product_search(self, update, context, category, product_name, manufacturer, model_name,
-                                             storage, target_price):
+    async def _handle_search_unavailable(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         await asyncio.sleep(1)
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="🔍 Searching for the best match...")
-        results, search_query = self.rainforest._search_mobile_product(
-            category, product_name, manufacturer, model_name, storage, target_price)
-        if not results:
-            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-            await asyncio.sleep(2)
-            await update.message.reply_text(
-                f"❌ No matching products found for *{product_name}*.\n\n"
-                "Please double-check the spelling, make sure it's a real product name, "
-                "and try again with more accurate details.\n\n"
-                "I can only search for *real products* that exist in the system."
-                "\n\nExample: 'iPhone 14 Pro Max 256GB', not just 'iPhone 14'.\n\n"
-                "Let me know when you're ready to try again!",
-                parse_mode="Markdown"
-            )
-            await self._handle_cancel(update, context)
-            await self._start_advanced_tracking(update, context)
-            return
-        else:
-            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_photo")
-            await asyncio.sleep(1.5)
-            selected_product = results[0]
-            found_product_name = selected_product.get("title")
-            escaped_name = self.escape_markdown(found_product_name)
-            price = self._parse_price(selected_product.get("price", {}).get("raw"))
-            image_url = selected_product.get("image")
-            keyboard = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("✅ Confirm", callback_data="confirm"),
-                    InlineKeyboardButton("❌ Cancel Search", callback_data="cancel_search")
-                ]
-            ])
-            caption = (
-                f"🛒 *Product:* {escaped_name}\n"
-                f"💰 *Current Price:* {self.escape_markdown(f'${price}')}\n\n"
-                "✅ *I'll use these details to track this item\\.*\n"
-                "❌ *If this is NOT the product you meant, click below or type* `/cancel` *to stop\\.*"
-            )
-            if image_url:
-                try:
-                    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_photo")
-                    await asyncio.sleep(2)
-                    await update.message.reply_photo(
-                        photo=image_url,
-                        caption=caption,
-                        parse_mode="MarkdownV2",
-                        reply_markup=keyboard
-                    )
-                except Exception as e:
-                    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-                    await asyncio.sleep(1)
-                    await update.message.reply_text(
-                        f"✅ *Found:* {found_product_name}\n"
-                        f"💰 *Price:* ${price}\n"
-                        "✅ *Tracking will start.*\n"
-                        "❌ *If this is not correct, type* `/cancel`.",
-                        parse_mode="MarkdownV2"
-                    )
-            else:
-                await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-                await asyncio.sleep(1.2)
-                await update.message.reply_text(
-                    f"✅ *Found:* {found_product_name}\n"
-                    f"💰 *Current Price:* {self.escape_markdown(f'${price}')}\n\n"
-                    "✅ *Tracking will start.*\n"
-                    "❌ *If this is not correct, type* `/cancel`.",
-                    parse_mode="MarkdownV2"
-                )
-            context.user_data["search_query"] = search_query
-            context.user_data["tracking_stage"] = "end_conversation"
+        await update.message.reply_text(
+            "⚠️ Product search is temporarily unavailable.\n"
+            "Your answers are saved — send your target price again in a few minutes to retry, "
+            "or type /cancel to stop."
+        )
 
     async def _handle_confirmation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
@@ -789,6 +1100,7 @@ class PriceTrackerBot:
         await query.answer()
         user_id = query.from_user.id
         if query.data == "cancel_search":
+            context.user_data.pop("candidates", None)
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             await asyncio.sleep(1)
             await context.bot.send_message(chat_id=user_id, text="❌ Cancelled current operation")
@@ -808,8 +1120,26 @@ class PriceTrackerBot:
             await update.message.reply_text("❌ Please specify a product to stop tracking")
             return
         product_name = " ".join(args)
-        success = self.user_manager.remove_tracking(user_id, product_name)
+        matches = await self.user_manager.find_trackings(user_id, product_name)
+        if len(matches) > 1 and matches[0]['rank'] != 0:
+            # Several trackings fit and none exactly: let the user pick instead of guessing
+            context.user_data['stop_candidates'] = [match['name'] for match in matches]
+            keyboard = InlineKeyboardMarkup(
+                [[InlineKeyboardButton(f"{match['name']} (Target: ${match['target_price']})",
+                                       callback_data=f"stop:{index}")]
+                 for index, match in enumerate(matches)]
+                + [[InlineKeyboardButton("❌ Keep them all", callback_data="stop:cancel")]]
+            )
+            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+            await asyncio.sleep(1)
+            await update.message.reply_text(
+                f"🔎 More than one tracking matches \"{product_name}\". Which one should I stop?",
+                reply_markup=keyboard
+            )
+            return
+        success = bool(matches) and await self.user_manager.remove_tracking_by_name(user_id, matches[0]['name'])
         if success:
+            product_name = matches[0]['name']
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             await asyncio.sleep(1)
             await update.message.reply_text(f"✅ Stopped tracking {product_name}")
@@ -818,29 +1148,94 @@ class PriceTrackerBot:
             await asyncio.sleep(1)
             await update.message.reply_text(f"❌ Not tracking {product_name}")
 
+    async def _handle_stop_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        candidates = context.user_data.pop('stop_candidates', [])
+        choice = query.data.split(":", 1)[1]
+        if choice == "cancel" or not choice.isdigit() or int(choice) >= len(candidates):
+            await query.edit_message_text("👍 Okay, still tracking everything.")
+            return
+        product_name = candidates[int(choice)]
+        if await self.user_manager.remove_tracking_by_name(query.from_user.id, product_name):
+            await query.edit_message_text(f"✅ Stopped tracking {product_name}")
+        else:
+            await query.edit_message_text(f"❌ Not tracking {product_name}")
+
     async def _handle_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        tracked_items = self.user_manager.get_tracked_items(user_id)
+        tracked_items = await self.user_manager.get_tracked_items(user_id)
         if not tracked_items:
             await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
             await asyncio.sleep(1)
             await update.message.reply_text("You're not tracking any products yet!")
             return
         response = "📋 Currently Tracking:\n" + "\n\n".join(
-            [f"- {item['name']} (Target: ${item['target_price']})"
+            [f"- {item.product_name} (Target: ${item.target_price})"
              for item in tracked_items])
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         await asyncio.sleep(2)
         await update.message.reply_text(response)
 
+    async def _handle_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Price history of the user's trackings (or those matching the argument) from past checks"""
+        user_id = update.effective_user.id
+        trackings = await self.user_manager.get_tracked_items(user_id)
+        if context.args:
+            product_name = " ".join(context.args)
+            names = {match['name'] for match in await self.user_manager.find_trackings(user_id, product_name)}
+            trackings = [tracking for tracking in trackings if tracking.product_name in names]
+            if not trackings:
+                await update.message.reply_text(f"❌ Not tracking {product_name}")
+                return
+        if not trackings:
+            await update.message.reply_text("You're not tracking any products yet!")
+            return
+        queries = {}
+        for tracking in trackings:
+            marketplaces = tracking.marketplaces or (DEFAULT_MARKETPLACE,)
+            queries[tracking.product_name] = (tracking.search_query, tracking.currency or MARKETPLACES[marketplaces[0]])
+        stats = await self.analytics.stats(queries.values())
+        sections = [self._format_stats(tracking, queries[tracking.product_name][1],
+                                       stats.get(queries[tracking.product_name]))
+                    for tracking in trackings[:10]]
+        await update.message.reply_text("\n\n".join(sections))
+
+    @staticmethod
+    def _format_stats(tracking, currency: str, stats) -> str:
+        if stats is None:
+            return f"📊 {tracking.product_name}\nNo price history yet: check back after the next price check."
+        if stats.latest <= stats.p25:
+            verdict = "👍 Good price: in the cheapest quarter seen"
+        elif stats.latest >= stats.p75:
+            verdict = "👎 High: in the dearest quarter seen"
+        else:
+            verdict = "➖ Typical price"
+        if abs(stats.trend_per_day) < 0.005:
+            trend = "flat"
+        else:
+            trend = f"{'▼' if stats.trend_per_day < 0 else '▲'} {abs(stats.trend_per_day):.2f} {currency}/day"
+        since = datetime.fromtimestamp(stats.first_at).strftime("%Y-%m-%d")
+        return (
+            f"📊 {tracking.product_name} ({stats.count} checks since {since})\n"
+            f"Latest: {stats.latest:.2f} {currency} (at or below {stats.latest_rank:.0%} of prices seen)\n"
+            f"{verdict}\n"
+            f"Low {stats.low:.2f} · Median {stats.median:.2f} · High {stats.high:.2f}\n"
+            f"Usual range (25–75%): {stats.p25:.2f}–{stats.p75:.2f}, (10–90%): {stats.p10:.2f}–{stats.p90:.2f}\n"
+            f"Trend: {trend} · Your target: {tracking.target_price:.2f} {currency}"
+        )
+
     async def _handle_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         help_text = (
             "💡 *Help Menu — What I Can Do*\n\n"
             "Here are the main commands you can use:\n\n"
-            "• `/track` – Start tracking a new product 📦. I’ll guide you step-by-step to set your target price and notify you when I find a match!\n\n"
+            "• `/track` – Start tracking a new product 📦. I’ll guide you step-by-step to set your target price and notify you when I find a match!\n"
+            "   _In a hurry? `/track \"PlayStation 5\" 499.99` searches and shows the match straight away._\n\n"
             "• `/list` – View all the products you're currently tracking 🧾.\n\n"
             "• `/stop [product name]` – Stop tracking a product from your list ❌\n"
             "   _Example: `/stop iPhone 14 Pro Max`_\n\n"
+            "• `/markets [ca us uk]` – Choose which Amazon stores I search 🌍\n\n"
+            "• `/stats [product name]` – Is this a good price? Lows, highs and trend from my past checks 📊\n\n"
             "• `/help` – Show this help menu anytime you need it 🤖.\n\n"
             "• `/cancel` – Cancel the current tracking setup process ⛔."
         )
@@ -852,301 +1247,365 @@ class PriceTrackerBot:
         self.logger.error(f"Update {update} caused error: {context.error}")
 
     async def _start_price_checks(self):
+        """
+        Turn the timing wheel: every tick, check the due trackings in that tick's slot.
+        After a restart the wheel carries on from the slot after the last one checked,
+        catching up on the ticks missed while the process was down (if under an interval).
+        """
+        wheel = self.wheel
+        await self._load_wheel()
+        cursor = await self.user_manager.get_sweep_cursor() or {}
+        last = (wheel.slot_at(time.time()) - 1) % wheel.slots
+        # A cursor saved with a different wheel size (batch mode switched) doesn't map onto this one
+        if "slot" in cursor and cursor.get("tick_at") and cursor.get("slots", self.WHEEL_SLOTS) == wheel.slots:
+            since = (datetime.now() - datetime.fromisoformat(cursor["tick_at"])).total_seconds()
+            if since < wheel.interval:
+                last = cursor["slot"]
+        # Deliver anything a previous run queued but didn't get to send
+        try:
+            await self._deliver_alerts()
+        except Exception as e:
+            self.logger.error(f"Alert delivery failed: {str(e)}")
+        pending = []
         while True:
+            now = time.time()
+            slots = wheel.slots_between(last, wheel.slot_at(now))
+            if slots:
+                # The first slot to run was due len(slots) - 1 ticks before the current tick began
+                tick_start = now - now % wheel.tick
+                lag = now - (tick_start - (len(slots) - 1) * wheel.tick)
+                # Catching up on several slots is several ticks' work, so it gets as many ticks to finish
+                self.checker.beat(tick_start + len(slots) * wheel.tick, lag)
+                if lag > wheel.tick:
+                    self.logger.warning(f"Price checks running {lag:.0f}s behind schedule",
+                                        extra={"schedule_lag": lag})
+                if 0 in slots:
+                    # Once a rotation, resync with the database so stopped trackings drop out
+                    await self._load_wheel()
+                pending = await self._run_tick(slots, pending)
+                last = slots[-1]
+                await self.user_manager.set_sweep_cursor({"slot": last, "slots": wheel.slots,
+                                                          "tick_at": datetime.now().isoformat()})
+            await asyncio.sleep(wheel.until_next_tick(time.time()))
+
+    async def _run_tick(self, slots: List[int], pending: List[tuple]) -> List[tuple]:
+        """
+        Check the due trackings in `slots`, plus the `pending` keys the breaker deferred last tick.
+        Returns the (user_id, product_name) keys deferred this time.
+        """
+        keys = list(dict.fromkeys(pending + [entry for slot in slots for entry in self.wheel.entries(slot)]))
+        if not keys:
+            return []
+        # Half an interval of slack: nothing is checked twice in a rotation, even when catching up
+        due_before = datetime.now() - timedelta(seconds=self.sweep_interval * 0.5)
+        trackings = await self.user_manager.get_due_trackings(due_before.isoformat(), keys)
+        if not trackings:
+            return []
+        profiler = None
+        if self.profile_every_sweep or self._profile_requested_by:
+            profiler = SweepProfiler(cprofile=bool(self.profile_dump_path))
+            profiler.start()
+        deferred = []
+        try:
+            deferred = await self._check_all_prices(trackings, profiler or NULL_PROFILER)
+        except Exception as e:
+            self.logger.error(f"Price check failed: {str(e)}")
+        if profiler:
+            profiler.stop()
+            await self._report_sweep_profile(profiler)
+        return [(tracking.user_id, tracking.product_name) for tracking in deferred]
+
+    async def _load_wheel(self):
+        """(Re)place every tracking on the wheel, dropping entries whose tracking is gone"""
+        known = set(self.wheel.keys())
+        trackings = await self.user_manager.get_all_trackings()
+        for tracking in trackings:
+            known.discard((tracking.user_id, tracking.product_name))
+            self._schedule(tracking.user_id, tracking.product_name, tracking.search_query)
+        # Only entries that were on the wheel before the read: anything added since is kept
+        for entry in known:
+            self.wheel.discard(entry)
+
+    def _schedule(self, user_id: int, product_name: str, search_query: Optional[str]):
+        """Put a tracking in its query's slot; trackings sharing a search share a slot (and a call)"""
+        if search_query:
+            self.wheel.add((user_id, product_name), search_query.lower())
+
+    async def _report_sweep_profile(self, profiler: SweepProfiler):
+        report = profiler.report()
+        self.logger.info(report, extra={"sweep_stages": {name: total for name, _, total in profiler.stages()},
+                                        "sweep_ms": profiler.wall_time * 1000})
+        if self.profile_dump_path:
+            profiler.dump(self.profile_dump_path)
+            # Under cProfile, also name the hottest functions (pstats' report, trimmed for Telegram)
+            hotspots = profiler.top_functions(10).strip()
+            if hotspots:
+                self.logger.info(f"Sweep hotspots (cumulative):\n{hotspots}")
+                report = f"{report}\n\nTop functions (cumulative):\n{hotspots}"[:self.TELEGRAM_MESSAGE_LIMIT]
+        requested_by, self._profile_requested_by = self._profile_requested_by, set()
+        for user_id in requested_by:
             try:
-                await self._check_all_prices()
-            except Exception as e:
-                self.logger.error(f"Price check failed: {str(e)}")
-            await asyncio.sleep(3600)
-
-    def _clean_mobile_text(self, text):
-        if not text:
-            return ""
-        text = text.lower()
-        text = re.sub(r'[^a-z0-9\s]', ' ', text)
-        text = re.sub(r'(\d)([a-z])', r'\1 \2', text)
-        text = re.sub(r'([a-z])(\d)', r'\1 \2', text)
-        return re.sub(r'\s+', ' ', text).strip()
-
-    def intended_mobile_product(self, search_query, title):
-        match_threshold = 0.9
-        if not search_query or not title:
-            return False
-        cleaned_query = self._clean_mobile_text(search_query)
-        cleaned_title = self._clean_mobile_text(title)
-        query_words = cleaned_query.split()
-        if not query_words:
-            return False
-        match_count = 0
-        for word in query_words:
-            safe_word = re.escape(word)
-            pattern = rf'\b{safe_word}\b'
-            if re.search(pattern, cleaned_title):
-                match_count += 1
-        match_ratio = match_count / len(query_words)
-        return match_ratio >= match_threshold
-
-    def _clean_laptop_product_text(self, text):
-        if not text:
-            return ""
-        text = text.lower()
-        text = re.sub(r'[^a-z0-9\s]', ' ', text)
-        text = re.sub(r'(\d)([a-z])', r'\1 \2', text)
-        text = re.sub(r'([a-z])(\d)', r'\1 \2', text)
-        return re.sub(r'\s+', ' ', text).strip()
-
-    def intended_laptop_product(self, search_query, title):
-        if not search_query or not title:
-            return False
-        cleaned_query = self._clean_laptop_product_text(search_query)
-        cleaned_title = self._clean_laptop_product_text(title)
-        query_words = cleaned_query.split()
-        if not query_words:
-            return False
-        match_count = 0
-        match_threshold = 0.9
-        for word in query_words:
-            safe_word = re.escape(word)
-            pattern = rf'\b{safe_word}\b'
-            if re.search(pattern, cleaned_title):
-                match_count += 1
-        match_ratio = match_count / len(query_words)
-        return match_ratio >= match_threshold
-
-    def _clean_product_text(self, text):
-        if not text:
-            return ""
-        text = text.lower()
-        text = re.sub(r'[^a-z0-9\s]', ' ', text)
-        text = re.sub(r'(\d)([a-z])', r'\1 \2', text)
-        text = re.sub(r'([a-z])(\d)', r'\1 \2', text)
-        return re.sub(r'\s+', ' ', text).strip()
-
-    def intended_gaming_product(self, search_query, title):
-        if not search_query or not title:
-            return False
-        cleaned_query = self._clean_product_text(search_query)
-        cleaned_title = self._clean_product_text(title)
-        query_words = cleaned_query.split()
-        if len(query_words) == 1:
-            pattern = rf'\b{re.escape(query_words[0])}\b'
-            return bool(re.search(pattern, cleaned_title))
-        match_count = 0
-        match_threshold = 0.9
-        for word in query_words:
-            safe_word = re.escape(word)
-            pattern = rf'\b{safe_word}\b'
-            if word in ['limited', 'special', 'collectors', 'edition', 'bundle']:
-                continue
-            if re.search(pattern, cleaned_title):
-                match_count += 1
-        base_words = [w for w in query_words if w not in
-                      ['limited', 'special', 'collectors', 'edition', 'bundle']]
-        if not base_words:
-            return False
-        match_ratio = match_count / len(base_words)
-        return match_ratio >= match_threshold
-
-    # def intended_gaming_product(self, search_query, title):
-    #     if not search_query or not title:
-    #         return False
-    #
-    #     cleaned_query = self._clean_product_text(search_query)
-    #     cleaned_title = self._clean_product_text(title)
-    #
-    #     # NEW: Strict accessory blocking layer
-    #     if self._is_accessory(cleaned_title):
-    #         return False
-    #
-    #     # ORIGINAL MATCHING ALGORITHM (unchanged)
-    #     query_words = cleaned_query.split()
-    #     if len(query_words) == 1:
-    #         pattern = rf'\b{re.escape(query_words[0])}\b'
-    #         return bool(re.search(pattern, cleaned_title))
-    #
-    #     match_count = 0
-    #     match_threshold = 0.9
-    #     for word in query_words:
-    #         safe_word = re.escape(word)
-    #         pattern = rf'\b{safe_word}\b'
-    #         if word in ['limited', 'special', 'collectors', 'edition', 'bundle']:
-    #             continue
-    #         if re.search(pattern, cleaned_title):
-    #             match_count += 1
-    #
-    #     base_words = [w for w in query_words if w not in
-    #                   ['limited', 'special', 'collectors', 'edition', 'bundle']]
-    #     if not base_words:
-    #         return False
-    #
-    #     match_ratio = match_count / len(base_words)
-    #     return match_ratio >= match_threshold
-    #
-    # # NEW ACCESSORY DETECTION METHOD
-    # def _is_accessory(self, cleaned_title):
-    #     """Determine if title is an accessory (cord, case, etc.)"""
-    #     # Block based on product type indicators
-    #     accessory_types = {
-    #         'cord', 'cable', 'wire', 'charger', 'adapter', 'case', 'cover',
-    #         'skin', 'protector', 'stand', 'mount', 'dock', 'grip', 'holder',
-    #         'remote', 'battery', 'power bank', 'stylus', 'pen', 'controller',
-    #         'headset', 'earbud', 'headphone', 'keyboard', 'mouse', 'mat'
-    #     }
-    #
-    #     # Block based on size/package indicators
-    #     size_indicators = {
-    #         'pack', 'set', 'kit', 'bundle', '2 pack', '3 pack', '4 pack',
-    #         'multi pack', 'twin pack', 'value pack', 'combo'
-    #     }
-    #
-    #     # Block based on material/color focus
-    #     material_focus = {
-    #         'silicone', 'rubber', 'plastic', 'metal', 'fabric', 'leather',
-    #         'nylon', 'carbon fiber', 'transparent', 'clear', 'colorful'
-    #     }
-    #
-    #     # Block if any accessory indicator is present
-    #     return (any(acc in cleaned_title for acc in accessory_types) or
-    #             any(size in cleaned_title for size in size_indicators) or
-    #             any(mat in cleaned_title for mat in material_focus))
-    #
-    # # ENHANCED CLEANING METHOD
-    # def _clean_product_text(self, text):
-    #     """Improved cleaning with accessory detection enhancements"""
-    #     if not text:
-    #         return ""
-    #     text = text.lower()
-    #
-    #     # Remove common accessory phrases that might be embedded in titles
-    #     accessory_phrases = [
-    #         "charging cable", "usb cable", "controller charger",
-    #         "protective case", "screen protector", "gaming headset",
-    #         "remote control", "battery pack", "skin decal"
-    #     ]
-    #     for phrase in accessory_phrases:
-    #         text = text.replace(phrase, "")
-    #
-    #     # Standard cleaning
-    #     text = re.sub(r'[^a-z0-9\s]', ' ', text)
-    #     text = re.sub(r'(\d)([a-z])', r'\1 \2', text)
-    #     text = re.sub(r'([a-z])(\d)', r'\1 \2', text)
-    #     return re.sub(r'\s+', ' ', text).strip()
-
-
-    async def _check_all_prices(self):
-        trackings = self.user_manager.get_all_trackings()
+                await self.application.bot.send_message(chat_id=user_id, text=f"⏱ {report}")
+            except TelegramError as e:
+                self.logger.warning(f"Could not send sweep profile to {user_id}: {e}")
+
+    async def _check_all_prices(self, trackings: List[Tracking], profiler=NULL_PROFILER):
+        """
+        Check `trackings`, the due ones from a tick of the timing wheel (see _run_tick).
+        Returns the trackings that were skipped because the Rainforest circuit is open.
+        Progress is checkpointed every CHECKPOINT_EVERY queries, so a restart mid-sweep
+        only re-checks what wasn't checked yet.
+        `profiler` (a metrics.SweepProfiler) times the fetch/filter/sort/match/send stages.
+        """
+        # Onboarding searches made since the last sweep count against this sweep's budget
+        await self._flush_api_calls(self.rainforest.drain_ledger())
         if not trackings:
-            return
+            return []
 
-        alerts_to_send = []
-        products_to_remove = []
+        sweep = {'id': datetime.now().strftime("%Y%m%d%H%M%S%f"), 'alerts': [], 'checked': [], 'groups': 0}
+        deferred = []
+        api_calls = []
 
+        group_items = self._group_trackings(trackings)
+        if self.credit_planner:
+            group_items = await self._plan_checks(group_items)
+        if self.batch_runner and group_items:
+            checked = set()
+            try:
+                await self._check_groups_batch(group_items, sweep, checked, profiler)
+            except (BatchError, CircuitOpenError) as e:
+                self.logger.warning(f"Batch sweep failed after {len(checked)} queries, "
+                                    f"checking the rest one by one: {e}")
+            calls = self.rainforest.drain_ledger()
+            api_calls.extend(calls)
+            if self.credit_planner:
+                now = datetime.now()
+                for key in checked:
+                    spent = sum(c.credits for c in calls if c.purpose != "onboarding" and c.search_term == key[0])
+                    self.credit_planner.observe(key, spent, now)
+            group_items = [(key, group) for key, group in group_items if key not in checked]
+        for index, (key, group) in enumerate(group_items):
+            search_query, category_name, marketplaces, currency = key
+            highest_target = max(tracking.target_price for tracking in group)
+            try:
+                # Filtering and query matching both happen inside track_product, in one pass per title
+                results = await asyncio.to_thread(self.rainforest.track_product, search_query, highest_target,
+                                                  get_category(category_name), list(marketplaces), currency,
+                                                  profiler)
+            except CircuitOpenError as e:
+                deferred = [tracking for _, pending in group_items[index:] for tracking in pending]
+                self.logger.warning(f"Rainforest circuit open, deferring {len(deferred)} checks: {e}")
+                break
+            finally:
+                calls = self.rainforest.drain_ledger()
+                api_calls.extend(calls)
+            if self.credit_planner:
+                self.credit_planner.observe(key, sum(c.credits for c in calls if c.purpose != "onboarding"),
+                                            datetime.now())
+
+            await self._finish_group(sweep, key, group, results, profiler)
+
+        await self._save_checkpoint(sweep, profiler)
+        with profiler.stage("send"):
+            await self._deliver_alerts()
+        await self._flush_api_calls(api_calls)
+        await self._flush_observations(self.rainforest.drain_observations())
+        return deferred
+
+    async def _finish_group(self, sweep: Dict, key, group, results, profiler=NULL_PROFILER):
+        self._collect_alerts(key, group, results, sweep['alerts'], profiler)
+        sweep['checked'].extend((tracking.user_id, tracking.product_name) for tracking in group)
+        sweep['groups'] += 1
+        if sweep['groups'] % self.CHECKPOINT_EVERY == 0:
+            await self._save_checkpoint(sweep, profiler)
+
+    async def _save_checkpoint(self, sweep: Dict, profiler=NULL_PROFILER):
+        """
+        Queue the alerts found since the last checkpoint, stop the matched trackings and mark
+        the checked ones, in one transaction. Delivery happens from the outbox afterwards.
+        """
+        messages = []
+        finished = []
+        for alert in sweep['alerts']:
+            user_id, product_name = alert.tracking.user_id, alert.tracking.product_name
+            if (user_id, product_name) not in finished:
+                finished.append((user_id, product_name))
+            messages.append({
+                'idempotency_key': f"{sweep['id']}:{user_id}:{product_name}:{len(messages)}",
+                'user_id': user_id,
+                'payload': {
+                    'kind': 'deal',
+                    'product_name': alert.title,
+                    'current_price': alert.current_price,
+                    'target_price': alert.tracking.target_price,
+                    'url': alert.url,
+                    'currency': alert.currency,
+                    'marketplace': alert.marketplace,
+                    'asin': alert.asin,
+                    'image': alert.image
+                }
+            })
+        for user_id, product_name in finished:
+            messages.append({
+                'idempotency_key': f"{sweep['id']}:{user_id}:{product_name}:stopped",
+                'user_id': user_id,
+                'payload': {'kind': 'stopped', 'product_name': product_name}
+            })
+        if messages or sweep['checked']:
+            with profiler.stage("send"):
+                await self.user_manager.record_deals(messages, finished, sweep['checked'],
+                                                     datetime.now().isoformat())
+        sweep['alerts'] = []
+        sweep['checked'] = []
+
+    def _collect_alerts(self, key, group, results, alerts_to_send, profiler=NULL_PROFILER):
+        search_query, _, _, currency = key
+        if not results:
+            self.logger.debug("Target not met for %r", search_query)
+            return
+        with profiler.stage("match"):
+            for tracking in group:
+                for result in results:
+                    if result.normalized_price > tracking.target_price:
+                        break
+                    # Collect alert instead of sending immediately
+                    alerts_to_send.append(Alert(tracking, result.title, result.normalized_price, currency,
+                                                result.link, result.marketplace, result.asin, result.image))
+
+    async def _check_groups_batch(self, group_items, sweep: Dict, checked: set, profiler=NULL_PROFILER):
+        """
+        Check every group through one batch job per results page, matching each query's
+        results as soon as they are in. Keys of the groups done so far are added to `checked`.
+        """
+        groups = dict(group_items)
+        checks = [(key, key[0], max(tracking.target_price for tracking in group), get_category(key[1]),
+                   list(key[2]), key[3]) for key, group in group_items]
+        stream = self.rainforest.track_products_batch(checks, self.batch_runner, profiler)
+        while True:
+            item = await asyncio.to_thread(next, stream, None)
+            if item is None:
+                return
+            key, results = item
+            checked.add(key)
+            await self._finish_group(sweep, key, groups[key], results, profiler)
+
+    def _group_trackings(self, trackings) -> List[tuple]:
+        """
+        Trackings that share a search are checked with one call, against the highest target among them.
+        Returns [((search_query, category, marketplaces, currency), [tracking, ...]), ...]
+        """
+        groups = {}
         for tracking in trackings:
-            search_query = tracking['product_data'].get("search_query").lower()
-            category = tracking['product_data'].get("category")
-            target_price = tracking['target_price']
-            user_id = tracking['user_id']
-            intended_title = tracking["product_name"].lower()
-            original_product_name = tracking["product_name"]  # Keep original name for removal
-
-            results = self.rainforest.track_product(search_query, target_price, category)
-
-            if category == "Phones":
-                if results:
-                    for item in results:
-                        title = item.get("title", "").lower()
-                        if self.intended_laptop_product(search_query, title):
-                            current_price = item.get("price")
-                            if isinstance(current_price, dict):
-                                current_price = current_price.get("value")
-
-                            # Collect alert instead of sending immediately
-                            alerts_to_send.append({
-                                'user_id': user_id,
-                                'product_name': item.get("title"),
-                                'current_price': current_price,
-                                'target_price': target_price,
-                                'url': item.get("link", ""),
-                                'original_name': original_product_name
-                            })
-                else:
-                    print(f"❌ Target not met for: {search_query}")
-
-            elif category == "Laptops":
-                if results:
-                    for item in results:
-                        title = item.get("title", "").lower()
-                        if self.intended_laptop_product(search_query, title):
-                            current_price = item.get("price")
-                            if isinstance(current_price, dict):
-                                current_price = current_price.get("value")
-
-                            # Collect alert instead of sending immediately
-                            alerts_to_send.append({
-                                'user_id': user_id,
-                                'product_name': item.get("title"),
-                                'current_price': current_price,
-                                'target_price': target_price,
-                                'url': item.get("link", ""),
-                                'original_name': original_product_name
-                            })
-            elif category == "Gaming":
-                if results:
-                    for item in results:
-                        title = item.get("title", "").lower()
-                        print(search_query)
-                        print(title)
-                        if self.intended_gaming_product(search_query, title):
-                            current_price = item.get("price")
-                            if isinstance(current_price, dict):
-                                current_price = current_price.get("value")
-
-                            alerts_to_send.append({
-                                'user_id': user_id,
-                                'product_name': item.get("title"),
-                                'current_price': current_price,
-                                'target_price': target_price,
-                                'url': item.get("link", ""),
-                                'original_name': original_product_name})
-            else:
-                print(f"❌ Target not met for: {search_query}")
-
-        # Send all collected alerts first
-        for alert in alerts_to_send:
+            category = get_category(tracking.category)
+            if not tracking.search_query or category is None:
+                continue
+            marketplaces = tracking.marketplaces or (DEFAULT_MARKETPLACE,)
+            currency = tracking.currency or MARKETPLACES[marketplaces[0]]
+            key = (tracking.search_query, category.name, marketplaces, currency)
+            groups.setdefault(key, []).append(tracking)
+        return list(groups.items())
+
+    async def _plan_checks(self, group_items: List[tuple]) -> List[tuple]:
+        """Keep the query groups this sweep's share of the monthly credit budget covers"""
+        planner = self.credit_planner
+        now = datetime.now()
+        month_start, _ = month_bounds(now)
+        used = sum((await self.user_manager.get_credit_usage(month_start.isoformat())).values())
+        # A check costs at least one page per marketplace until we've seen what it really costs
+        candidates = [(key, len(group), len(key[2])) for key, group in group_items]
+        checked, skipped = planner.plan(candidates, used, now)
+        projected = planner.projected_usage(used, now)
+        if skipped:
+            self.logger.info(f"Credit budget: checking {len(checked)} queries, deferring {len(skipped)} "
+                             f"({used}/{planner.monthly_budget} used)")
+        if projected > planner.monthly_budget:
+            self.logger.warning(f"Credit usage projected at {projected:.0f} for the month, "
+                                f"over the budget of {planner.monthly_budget}")
+        checked = set(checked)
+        return [(key, group) for key, group in group_items if key in checked]
+
+    async def _flush_api_calls(self, calls):
+        if calls:
+            await self.user_manager.record_api_calls(calls)
+
+    async def _flush_observations(self, observations):
+        if observations:
+            await self.user_manager.record_price_observations(observations)
+            self.analytics.invalidate(observations)
+
+    async def _deliver_alerts(self, batch_size: int = 50):
+        """
+        Drain the alert outbox. Delivered rows are marked sent with one commit per batch,
+        so a crash mid-batch can only repeat messages from that batch.
+        """
+        while True:
+            pending = await self.user_manager.get_pending_alerts(batch_size)
+            if not pending:
+                return
+            delivered = []
+            stalled = False
+            for alert in pending:
+                try:
+                    await self._send_outbox_message(alert['user_id'], alert['payload'])
+                except (Forbidden, BadRequest) as e:
+                    # The user blocked the bot or the chat is gone: retrying won't help
+                    self.logger.warning(f"Dropping alert {alert['idempotency_key']}: {e}")
+                except TelegramError as e:
+                    self.logger.error(f"Alert delivery failed, will retry next sweep: {e}")
+                    stalled = True
+                    break
+                delivered.append(alert['id'])
+            if delivered:
+                await self.user_manager.mark_alerts_sent(delivered)
+            if stalled or len(pending) < batch_size:
+                return
+
+    async def _send_outbox_message(self, user_id: int, payload: Dict):
+        if payload.get('kind') == 'deal':
             await self._send_price_alert(
-                alert['user_id'],
-                alert['product_name'],
-                alert['current_price'],
-                alert['target_price'],
-                alert['url']
+                user_id,
+                payload['product_name'],
+                payload['current_price'],
+                payload['target_price'],
+                payload['url'],
+                payload['currency'],
+                payload['marketplace'],
+                payload.get('asin'),
+                payload.get('image')
+            )
+        elif payload.get('kind') == 'stopped':
+            await self.application.bot.send_message(
+                chat_id=user_id,
+                text=f"✅ We found a deal for {payload['product_name']} and have stopped tracking it. "
+                     "You can track it again anytime with /track."
             )
-
-            products_to_remove.append((alert['user_id'], alert['original_name']))
-
-
-        for user_id, product_name in products_to_remove:
-            if self.user_manager.remove_tracking(user_id, product_name):
-
-                await self.application.bot.send_message(
-                    chat_id=user_id,
-                    text=f"✅ We found a deal for {product_name} and have stopped tracking it. "
-                         "You can track it again anytime with /track."
-                )
 
     async def _send_price_alert(self, user_id: int, product_name: str,
-                                current_price: float, target_price: float, url: str):
+                                current_price: float, target_price: float, url: str,
+                                currency: str = "CAD", marketplace: str = DEFAULT_MARKETPLACE,
+                                asin: Optional[str] = None, image: Optional[str] = None):
         message = (
             f"🚨 Price Alert: {product_name}\n\n"
-            f"💰 Price Found: ${current_price}\n"
-            f"🎯 Your Target: ${target_price}\n"
+            f"💰 Price Found: {current_price:.2f} {currency} on {marketplace}\n"
+            f"🎯 Your Target: {target_price:.2f} {currency}\n"
             f"🔗 {url}"
         )
+        # Only with a photo Telegram already has: alerts shouldn't wait on an Amazon image download
+        file_id = await self.file_ids.get(asin, image) if asin or image else None
+        if file_id:
+            try:
+                await self.application.bot.send_photo(chat_id=user_id, photo=file_id, caption=message)
+                return
+            except BadRequest as e:
+                self.logger.info(f"Cached photo for {asin or image} was rejected: {e}")
+                await self.file_ids.forget(asin, image)
         await self.application.bot.send_message(
             chat_id=user_id,
             text=message
         )
 
     async def _handle_cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        self._cancel_prefetch(context)
         context.user_data.clear()
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         await asyncio.sleep(1)
@@ -1156,13 +1615,23 @@ class PriceTrackerBot:
         await self.application.initialize()
         await self.application.start()
         await self.application.updater.start_polling()
-        asyncio.create_task(self._start_price_checks())
+        checker = asyncio.create_task(self.checker.run())
+        health_server = None
+        if os.getenv("PORT"):
+            # For the platform's health check: 503 once checks fall HEALTH_MAX_LAG behind schedule
+            health_server = await serve_health(self.checker, int(os.getenv("PORT")),
+                                               max_lag=float(os.getenv("HEALTH_MAX_LAG", "600")))
         try:
             while True:
                 await asyncio.sleep(3600)
         except asyncio.CancelledError:
+            await self.checker.stop()
+            checker.cancel()
+            if health_server:
+                health_server.close()
             await self.application.stop()
             await self.application.shutdown()
+            self.user_manager.close()
 
     async def _save_advanced_tracking(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -1172,26 +1641,41 @@ class PriceTrackerBot:
         product_data = {
             "category": context.user_data.get("category"),
             "manufacturer": context.user_data.get("mobile_manufacturer_name") or context.user_data.get(
-                "laptop_manufacture_name") or context.user_data.get("gaming_manufacturer_name"),
+                "laptop_manufacturer_name") or context.user_data.get("gaming_manufacturer_name") or context.user_data.get(
+                "manufacturer_name"),
             "model_name": context.user_data.get("model_name") or context.user_data.get(
                 "laptop_model_name") or context.user_data.get("headphones_model"),
             "storage": context.user_data.get("mobile_storage") or context.user_data.get("laptop_storage"),
             "ram": context.user_data.get("laptop_ram"),
             "processor": context.user_data.get("laptop_processor"),
-            "search_query": context.user_data.get("search_query")
+            "search_query": context.user_data.get("search_query"),
+            "marketplaces": await self._user_marketplaces(user_id),
         }
+        product_data["currency"] = MARKETPLACES[product_data["marketplaces"][0]]
+        # The listing the user picked in the confirm step
+        candidates = context.user_data.get("candidates") or []
+        selected = context.user_data.get("selected_candidate", 0)
+        chosen = candidates[selected] if selected < len(candidates) else None
+        if chosen:
+            product_data["matched_title"] = chosen.title
         product_data = {k: v for k, v in product_data.items() if v is not None}
-        self.user_manager.add_tracking(
+        await self.user_manager.add_tracking(
             user_id=user_id,
             product_name=product_name,
             target_price=target_price,
-            sku="",
+            sku=(chosen.asin or "") if chosen else "",
             product_data=product_data
         )
+        # Checked from its slot in the current rotation rather than after the next full pass
+        self._schedule(user_id, product_name, product_data.get("search_query"))
 
 
 if __name__ == "__main__":
     import asyncio
-    # load_dotenv()
+    load_dotenv()
+    setup_logging(level=os.getenv("LOG_LEVEL", "INFO"),
+                  json_format=os.getenv("LOG_FORMAT", "text") == "json",
+                  log_file=os.getenv("LOG_FILE", "price_tracker.log") or None,
+                  debug_sample_rate=float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01")))
     bot = PriceTrackerBot()
     asyncio.run(bot.run())
@@ -0,0 +1,69 @@
+import asyncio
+from collections import OrderedDict
+from typing import List, Optional
+
+
+class FileIdCache:
+    """
+    Telegram file_ids of product photos we've already sent, keyed by ASIN and by image URL,
+    so Telegram downloads an Amazon image once and later sends reuse the id. Holds at most
+    `capacity` keys, evicting the least recently used; persisted in the media_cache table
+    and loaded on first use.
+    """
+
+    def __init__(self, user_manager, capacity: int = 5000):
+        self.user_manager = user_manager
+        self.capacity = capacity
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    @staticmethod
+    def _keys(asin: Optional[str], url: Optional[str]) -> List[str]:
+        keys = []
+        if asin:
+            keys.append(f"asin:{asin}")
+        if url:
+            keys.append(f"url:{url}")
+        return keys
+
+    async def _ensure_loaded(self):
+        async with self._load_lock:
+            if self._loaded:
+                return
+            rows = await self.user_manager.get_media_file_ids(self.capacity)
+            # Rows come newest first; insert oldest first so the newest are the most recently used
+            for key, file_id in reversed(rows):
+                self._entries[key] = file_id
+            self._loaded = True
+
+    async def get(self, asin: Optional[str], url: Optional[str]) -> Optional[str]:
+        if not self._loaded:
+            await self._ensure_loaded()
+        for key in self._keys(asin, url):
+            file_id = self._entries.get(key)
+            if file_id:
+                self._entries.move_to_end(key)
+                return file_id
+        return None
+
+    async def put(self, asin: Optional[str], url: Optional[str], file_id: str):
+        if not self._loaded:
+            await self._ensure_loaded()
+        entries = [(key, file_id) for key in self._keys(asin, url)]
+        for key, _ in entries:
+            self._entries[key] = file_id
+            self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.capacity:
+            evicted.append(self._entries.popitem(last=False)[0])
+        await self.user_manager.save_media_file_ids(entries, evicted)
+
+    async def forget(self, asin: Optional[str], url: Optional[str]):
+        """Drop a file_id Telegram no longer accepts"""
+        keys = [key for key in self._keys(asin, url) if self._entries.pop(key, None) is not None]
+        if keys:
+            await self.user_manager.save_media_file_ids([], keys)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,97 @@
+"""
+Memory per loaded tracking: the slotted Tracking record against the old shape, a dict
+per row holding its product_data JSON decoded into a nested dict.
+
+Rows are generated the way _save_advanced_tracking writes them, with many users tracking
+the same few hundred searches, fetched from SQLite once, then loaded both ways under
+tracemalloc (the fetched rows themselves aren't counted).
+
+    python memory_benchmark.py --trackings 100000
+"""
+import json
+import random
+import sqlite3
+import argparse
+import tracemalloc
+from typing import Callable, List
+
+from models import Tracking
+from user_manager import UserManager
+
+CATEGORIES = {
+    "Phones": ["Apple", "Samsung", "Google"],
+    "Laptops": ["Lenovo", "Dell", "ASUS"],
+    "Gaming": ["Sony", "Nintendo", "Microsoft"],
+    "Headphones": ["Sony", "Bose", "Apple"],
+}
+MARKETPLACES = [["amazon.ca"], ["amazon.com"], ["amazon.ca", "amazon.com"]]
+
+
+def dict_row(row) -> dict:
+    """How get_all_trackings returned a row before Tracking"""
+    return {
+        'user_id': row[0],
+        'product_name': row[1],
+        'target_price': row[2],
+        'sku': row[3],
+        'product_data': json.loads(row[4])
+    }
+
+
+def populate(user_manager: UserManager, trackings: int, searches: int):
+    items = []
+    for n in range(trackings):
+        category = random.choice(list(CATEGORIES))
+        manufacturer = random.choice(CATEGORIES[category])
+        search = n % searches
+        marketplaces = random.choice(MARKETPLACES)
+        items.append({
+            'user_id': n // 5,
+            'product_name': f"{manufacturer} model {search}",
+            'target_price': round(random.uniform(50, 2500), 2),
+            'sku': f"B0{search:08d}",
+            'product_data': {
+                "category": category,
+                "manufacturer": manufacturer,
+                "model_name": f"model {search}",
+                "search_query": f"{manufacturer} model {search} {category}".lower(),
+                "marketplaces": marketplaces,
+                "currency": "CAD" if marketplaces[0] == "amazon.ca" else "USD",
+                "matched_title": f"{manufacturer} Model {search} ({category}, Renewed)",
+            },
+        })
+    user_manager.add_trackings(items)
+
+
+def measure(rows: List[tuple], load: Callable) -> float:
+    """Bytes allocated per row by `load`, for as long as the loaded list is kept"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    loaded = [load(row) for row in rows]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del loaded
+    return used / len(rows)
+
+
+def run(trackings: int, searches: int):
+    user_manager = UserManager(sqlite3.connect(":memory:"))
+    populate(user_manager, trackings, searches)
+    rows = user_manager.conn.execute('''
+        SELECT user_id, product_name, target_price, sku, product_data FROM trackings
+    ''').fetchall()
+    as_dicts = measure(rows, dict_row)
+    as_records = measure(rows, lambda row: Tracking.from_row(*row))
+    print(f"{len(rows)} trackings over {searches} distinct searches")
+    print(f"  dict + decoded JSON: {as_dicts:8.0f} bytes/tracking")
+    print(f"  Tracking:            {as_records:8.0f} bytes/tracking  ({as_dicts / as_records:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trackings", type=int, default=100000)
+    parser.add_argument("--searches", type=int, default=500, help="distinct search queries the trackings share")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    run(args.trackings, args.searches)
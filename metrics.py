@@ -0,0 +1,114 @@
+import io
+import time
+import pstats
+import cProfile
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Tuple
+
+_NOOP = nullcontext()
+
+
+class LatencyStats:
+    """Wall time per key (command, callback or tracking_stage), keeping the last `window` samples"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def summary(self) -> List[Tuple[str, int, float, float, float]]:
+        """(key, calls, p50 ms, p99 ms, max ms) over the window, slowest p99 first"""
+        with self._lock:
+            snapshot = {key: sorted(samples) for key, samples in self._samples.items()}
+            counts = dict(self._counts)
+        rows = []
+        for key, samples in snapshot.items():
+            p50 = samples[len(samples) // 2]
+            p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+            rows.append((key, counts[key], p50 * 1000, p99 * 1000, samples[-1] * 1000))
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows
+
+
+class SweepProfiler:
+    """
+    Per-stage timings (fetch, filter, sort, match, send) for one price-check cycle.
+
+    Stages can be timed from several threads at once (marketplaces and pages are fetched
+    concurrently), so totals are summed thread time and may exceed the cycle's wall time.
+    With `cprofile=True` the event loop thread is also run under cProfile.
+    """
+
+    def __init__(self, cprofile: bool = False):
+        self._totals: Dict[str, float] = {}
+        self._calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._profile = cProfile.Profile() if cprofile else None
+        self._started = None
+        self.wall_time = 0.0
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self._profile:
+            self._profile.enable()
+
+    def stop(self):
+        if self._profile:
+            self._profile.disable()
+        self.wall_time = time.perf_counter() - self._started
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._totals[name] = self._totals.get(name, 0.0) + elapsed
+                self._calls[name] = self._calls.get(name, 0) + 1
+
+    def stages(self) -> List[Tuple[str, int, float]]:
+        """(stage, calls, total ms), slowest first"""
+        with self._lock:
+            rows = [(name, self._calls[name], total * 1000) for name, total in self._totals.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+    def report(self) -> str:
+        lines = [f"Sweep took {self.wall_time * 1000:.0f} ms"]
+        lines += [f"{name}: {total:.1f} ms over {calls} call(s)" for name, calls, total in self.stages()]
+        return "\n".join(lines)
+
+    def dump(self, path: str):
+        """Write the cProfile stats to `path` (loadable with pstats / snakeviz)"""
+        if self._profile:
+            self._profile.dump_stats(path)
+
+    def top_functions(self, limit: int = 20) -> str:
+        if not self._profile:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+class _NullProfiler:
+    """Stand-in used when profiling is off: stage() hands back one shared no-op context"""
+
+    def stage(self, name: str):
+        return _NOOP
+
+
+NULL_PROFILER = _NullProfiler()
@@ -0,0 +1,151 @@
+import sys
+import json
+from typing import NamedTuple, Optional, Tuple
+
+from categories import tokenize
+
+
+def parse_price(price_str) -> Optional[float]:
+    """
+    Converts price strings like "$1,299.99" or "CDN$ 1,299.99" into float: 1299.99
+    Returns None if price is missing or invalid.
+    """
+    if price_str:
+        try:
+            return float(price_str.replace("CDN$", "").replace("$", "").replace("£", "")
+                         .replace(",", "").strip())
+        except Exception:
+            return None
+    return None
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else value
+
+
+class Tracking:
+    """
+    One row of `trackings`, with the fields the checker needs pulled out of the
+    product_data JSON once at load. Slotted and with interned category/query/
+    marketplace strings, since many trackings share them.
+    """
+    __slots__ = ("user_id", "product_name", "target_price", "sku",
+                 "category", "search_query", "marketplaces", "currency")
+
+    def __init__(self, user_id: int, product_name: str, target_price: float, sku: str = "",
+                 category: Optional[str] = None, search_query: Optional[str] = None,
+                 marketplaces: Tuple[str, ...] = (), currency: Optional[str] = None):
+        self.user_id = user_id
+        self.product_name = product_name
+        self.target_price = target_price
+        self.sku = sku
+        self.category = _intern(category)
+        self.search_query = _intern(search_query.lower()) if search_query else None
+        self.marketplaces = tuple(_intern(m) for m in marketplaces)
+        self.currency = _intern(currency)
+
+    @classmethod
+    def from_row(cls, user_id, product_name, target_price, sku, product_data: str) -> "Tracking":
+        data = json.loads(product_data) if product_data else {}
+        return cls(user_id, product_name, target_price, sku or "",
+                   data.get("category"), data.get("search_query"),
+                   data.get("marketplaces") or (), data.get("currency"))
+
+    def __repr__(self):
+        return (f"Tracking(user_id={self.user_id!r}, product_name={self.product_name!r}, "
+                f"target_price={self.target_price!r}, category={self.category!r}, "
+                f"search_query={self.search_query!r})")
+
+
+class Alert:
+    """A deal found for one tracking, waiting to be queued in the outbox"""
+    __slots__ = ("tracking", "title", "current_price", "currency", "url", "marketplace", "asin", "image")
+
+    def __init__(self, tracking: Tracking, title: str, current_price: float, currency: str,
+                 url: str, marketplace: str, asin: Optional[str] = None, image: Optional[str] = None):
+        self.tracking = tracking
+        self.title = title
+        self.current_price = current_price
+        self.currency = currency
+        self.url = url
+        self.marketplace = marketplace
+        self.asin = asin
+        self.image = image
+
+
+class SearchResult(NamedTuple):
+    """
+    The parts of a Rainforest search result we use, parsed once at ingest.
+    `normalized_price` and `match_score` are filled in by the checker/search
+    (via _replace) since they depend on the user's currency and query.
+    """
+    asin: Optional[str]
+    title: str
+    tokens: Tuple[str, ...]
+    price: Optional[float]
+    currency: Optional[str]
+    link: str
+    image: Optional[str]
+    marketplace: Optional[str] = None
+    normalized_price: Optional[float] = None
+    match_score: float = 0.0
+
+    @classmethod
+    def from_payload(cls, item: dict, marketplace: Optional[str] = None) -> "SearchResult":
+        title = item.get("title") or ""
+        price, currency = None, None
+        raw_price = item.get("price")
+        if isinstance(raw_price, dict):
+            price = raw_price.get("value")
+            currency = raw_price.get("currency")
+            if price is None:
+                price = parse_price(raw_price.get("raw"))
+        elif isinstance(raw_price, str):
+            price = parse_price(raw_price)
+        elif isinstance(raw_price, (int, float)):
+            price = raw_price
+        return cls(
+            asin=item.get("asin"),
+            title=title,
+            tokens=tokenize(title),
+            price=float(price) if price is not None else None,
+            currency=_intern(currency),
+            link=item.get("link") or "",
+            image=item.get("image"),
+            marketplace=_intern(marketplace),
+        )
+
+
+class ApiCall(NamedTuple):
+    """One billed (or failed) Rainforest request, buffered until the checker flushes it to the ledger"""
+    called_at: str
+    purpose: str          # "onboarding", "sweep" or "retry"
+    amazon_domain: Optional[str]
+    search_term: Optional[str]
+    credits: int
+    status: Optional[int]  # HTTP status, None when the request never got a response
+
+
+class PriceObservation(NamedTuple):
+    """Cheapest matching price one check found for a query, kept as price history for /stats"""
+    observed_at: float  # Unix seconds, so the analytics can load the column straight into a float array
+    search_query: str
+    currency: str
+    price: float
+    marketplace: Optional[str]
+
+
+class KnownProduct(NamedTuple):
+    """A listing seen in a search, with what it takes to start tracking it (see product_index)"""
+    result: SearchResult
+    category: str
+    search_query: str
+    seen_at: float = 0.0  # Unix seconds
+
+    @classmethod
+    def from_row(cls, asin, title, price, currency, link, image, marketplace, category, search_query,
+                 seen_at) -> "KnownProduct":
+        result = SearchResult(asin=asin, title=title, tokens=tokenize(title), price=price,
+                              currency=_intern(currency), link=link or "", image=image,
+                              marketplace=_intern(marketplace))
+        return cls(result, _intern(category), search_query, seen_at)
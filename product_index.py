@@ -0,0 +1,91 @@
+import bisect
+import heapq
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from categories import tokenize
+from models import KnownProduct
+
+
+class ProductIndex:
+    """
+    Inverted index (title token -> ASINs) over listings the bot has already seen, so inline
+    queries are answered from memory instead of a Rainforest search. Every query token must
+    appear in the title; the last one may be a prefix, since inline queries arrive while the
+    user is still typing. Holds the `capacity` most recently seen listings.
+    """
+
+    def __init__(self, capacity: int = 20000):
+        self.capacity = capacity
+        self._products: "OrderedDict[str, KnownProduct]" = OrderedDict()
+        self._tokens: Dict[str, frozenset] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        # Sorted tokens for prefix lookups, rebuilt on the next search after the token set changes
+        self._vocabulary: List[str] = []
+        self._vocabulary_stale = False
+        # Bumped on every change, so callers can tell when cached answers are out of date
+        self.version = 0
+
+    def add(self, product: KnownProduct):
+        asin = product.result.asin
+        if not asin:
+            return
+        self._remove(asin)
+        self._products[asin] = product
+        tokens = self._tokens[asin] = frozenset(tokenize(product.result.title))
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                self._vocabulary_stale = True
+            postings.add(asin)
+        while len(self._products) > self.capacity:
+            self._remove(next(iter(self._products)))
+        self.version += 1
+
+    def _remove(self, asin: str):
+        if self._products.pop(asin, None) is None:
+            return
+        for token in self._tokens.pop(asin):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(asin)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary_stale = True
+
+    def get(self, asin: str) -> Optional[KnownProduct]:
+        return self._products.get(asin)
+
+    def _with_prefix(self, prefix: str) -> Set[str]:
+        if self._vocabulary_stale:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_stale = False
+        asins = set()
+        for index in range(bisect.bisect_left(self._vocabulary, prefix), len(self._vocabulary)):
+            token = self._vocabulary[index]
+            if not token.startswith(prefix):
+                break
+            asins |= self._postings[token]
+        return asins
+
+    def search(self, text: str, limit: int = 20) -> List[KnownProduct]:
+        """Listings matching every word of `text`: most specific title first, then cheapest"""
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        # A trailing space means the last word is finished, so it has to match exactly too
+        whole, prefix = (tokens, None) if text[-1:].isspace() else (tokens[:-1], tokens[-1])
+        matches = [self._postings.get(token, set()) for token in whole]
+        if prefix is not None:
+            matches.append(self._with_prefix(prefix))
+        matches.sort(key=len)
+        asins = set(matches[0]).intersection(*matches[1:])
+        best = heapq.nsmallest(limit, asins, key=lambda asin: (
+            len(self._tokens[asin]), self._products[asin].result.price is None,
+            self._products[asin].result.price or 0.0))
+        return [self._products[asin] for asin in best]
+
+    def __len__(self) -> int:
+        return len(self._products)
@@ -1,417 +1,484 @@
-import requests
+import time
+import heapq
 import random
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Iterable, List
 
-# from scraper import response
-
-
-class RainforestAPI:
-    def __init__(self,api_key):
-        self.api_key = api_key
-        self.base_url =  "https://api.rainforestapi.com/request"
-
-
-    def merge(self,left,right):
-        lst = []
-        while len(left) != 0 and len(right) != 0:
-            left_price = left[0].get("price", float("inf"))
-            right_price = right[0].get("price", float("inf"))
-            if isinstance(left_price,dict):
-                left_price = left_price.get("value")
-            if isinstance(right_price,dict):
-                right_price = right_price.get("value")
-            if left_price is None and right_price is None:
-                left.pop(0)
-                right.pop(0)
-            elif left_price is None:
-                left.pop(0)
-            elif right_price is None:
-                right.pop(0)
-            elif left_price < right_price:
-                lst.append(left.pop(0))
-            else:
-                lst.append(right.pop(0))
-
-        lst.extend(left)
-        lst.extend(right)
-        return lst
-
-    def merge_sort(self,lst):
-        if len(lst) == 1:
-            return lst
-        else:
-            mid = len(lst) // 2
-            left = lst[:mid]
-            right = lst[mid:]
-            return self.merge(self.merge_sort(left),self.merge_sort(right))
-
-
-
-
-    def is_real_mobile_product(self,title):
-        title = title.lower()
-        # unwanted = ["case","cover","screen protector","charger","cable","mount","stand"]
-        blocked_keywords = [
-            # Accessories
-            "case", "cover", "screen protector", "charger", "cable", "wireless charger", "earbud", "earphones",
-            "headphones",
-
-            # Storage
-            "usb", "flash drive", "memory stick", "sd card", "micro sd", "external storage",
-
-            # Pens & Stylus
-            "pen", "stylus", "touch pen",
-
-            # Misc gadgets
-            "tripod", "mount", "stand", "holder", "pop socket", "ring light", "camera lens",
-
-            # SIM & Cards
-            "sim card", "sim tool", "nano sim", "adapter",
-
-            # Tablets & Smartwatches
-            "tablet", "iPad", "watch", "smartwatch", "fitness tracker", "band",
-
-            # Household/Random
-            "remote", "fan", "lamp", "light bulb", "calculator", "speaker", "radio",
-
-            # Toys & Knockoffs
-            "toy", "kids phone", "fake phone", "learning phone",
-
-            # Brands not phones
-            "Logitech", "SanDisk", "Kingston", "TP-Link", "NETGEAR", "JBL", "Anker", "Bose"
-        ]
+import requests
 
-        for i in blocked_keywords:
-            if i in title:
-                return False
-        return True
-
-    # def is_real_console_product(self, title):
-    #     title = title.lower()
-    #
-    #     # Positive indicators - must have at least one of these
-    #     console_keywords = [
-    #         "playstation", "ps5", "xbox", "nintendo switch",
-    #         "series x", "series s", "console", "system"
-    #     ]
-    #
-    #     # Negative indicators - must not have any of these
-    #     accessory_keywords = [
-    #         "controller", "case", "cover", "skin", "charger", "dock",
-    #         "headset", "earbud", "headphone", "remote", "stand", "mount",
-    #         "game", "disc", "edition", "digital code", "subscription",
-    #         "blu-ray", "memory card", "gift card", "bundle"
-    #     ]
-    #
-    #     # Check for positive indicators
-    #     has_console_keyword = any(kw in title for kw in console_keywords)
-    #
-    #     # Check for accessory indicators
-    #     has_accessory_keyword = any(kw in title for kw in accessory_keywords)
-    #
-    #     # It's a console if:
-    #     # 1. Has a console keyword AND
-    #     # 2. Does NOT have accessory keywords
-    #     return has_console_keyword and not has_accessory_keyword
-
-    def is_real_console_product(self, title):
-        title = title.lower()
-        blocked_keywords = [
-            # Accessories and peripherals
-            "controller", "charging dock", "accessory", "cable", "adapter",
-            "headset", "skin", "cover", "case", "joystick", "keyboard", "monitor",
-            "memory card", "gift card", "remote", "stand", "cooler", "fan", "mount",
-
-            # Game-related terms
-            "game", "disc", "edition", "deluxe", "ultimate", "collector",
-            "launch", "remastered", "digital", "code", "playstation hits", "subscription",
-            "software", "cartridge", "bundle", "set", "blu-ray",
-
-            # Known PS/Xbox/Nintendo game titles and game studios
-            "astro bot", "god of war", "spider-man", "elden ring", "call of duty",
-            "fifa", "nba", "horizon", "death stranding", "gta", "minecraft", "fortnite",
-            "ghost song", "tekken", "mortal kombat", "battlefield", "witcher", "resident evil",
-            "bandai", "ubisoft", "rockstar", "capcom", "ea sports", "asobi", "studio", "square enix"
-        ]
+from categories import Category
+from models import SearchResult, ApiCall, PriceObservation
+from metrics import NULL_PROFILER
 
-        valid_console_names = [
-            "playstation 5 console", "ps5 console", "xbox series x console",
-            "xbox console", "xbox series s", "nintendo switch console"
-        ]
+# from scraper import response
 
-        if not any(console in title for console in valid_console_names):
+logger = logging.getLogger(__name__)
+
+
+# Marketplaces we can search, with the currency their prices are listed in
+MARKETPLACES = {
+    "amazon.ca": "CAD",
+    "amazon.com": "USD",
+    "amazon.co.uk": "GBP",
+}
+DEFAULT_MARKETPLACE = "amazon.ca"
+
+# Approximate value of one unit of each currency in CAD, used to compare prices across marketplaces.
+# Defaults only: set CURRENCY_RATES (see parse_currency_rates) to keep them current
+CURRENCY_RATES = {
+    "CAD": 1.0,
+    "USD": 1.37,
+    "GBP": 1.85,
+}
+
+
+def parse_currency_rates(spec: str, defaults: dict = CURRENCY_RATES) -> dict:
+    """
+    `defaults` overridden by a "USD=1.37,GBP=1.85" spec: the value of one unit of each
+    currency in CAD (any common base works, only the ratios matter)
+    """
+    rates = dict(defaults)
+    for entry in filter(None, (part.strip() for part in (spec or "").split(","))):
+        currency, sep, value = entry.partition("=")
+        try:
+            rate = float(value)
+        except ValueError:
+            rate = 0.0
+        if not sep or rate <= 0:
+            raise ValueError(f"Invalid currency rate {entry!r}, expected e.g. USD=1.37")
+        rates[currency.strip().upper()] = rate
+    return rates
+
+
+def convert_price(amount: float, from_currency: str, to_currency: str, rates: dict = CURRENCY_RATES) -> float:
+    if from_currency == to_currency:
+        return amount
+    return round(amount * rates[from_currency] / rates[to_currency], 2)
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is open and Rainforest calls are being skipped."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rainforest circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops calling Rainforest after repeated failures.
+    closed -> open after `failure_threshold` consecutive failures,
+    open -> half_open once `reset_timeout` seconds have passed (one trial call),
+    half_open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 300):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
             return False
-        return True
-
-
-        # for word in blocked_keywords:
-        #     if word in title:
-        #         return False
-        # return True
-
-    def is_real_laptop_product(self, title):
-        title = title.lower()
-        blocked_keywords = [
-            # Accessories (explicit ones only)
-            "laptop case", "sleeve", "keyboard cover", "screen protector", "cooling pad",
-            "mount", "docking station", "usb hub", "mouse only", "keyboard only",
-            "external hard drive", "external ssd", "webcam only", "microphone only",
-
-            # Components as standalone items (not inside laptops)
-            "ram module", "memory module", "barebone ssd", "barebone hdd", "graphics card", "motherboard", "cpu only",
-            "processor only",
 
-            # Non-laptop devices
-            "tablet", "ipad", "chromebook", "netbook", "surface go", "surface pro", "kindle",
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
 
-            # Brands that don’t sell laptops
-            "logitech", "sandisk", "kingston", "tp-link", "netgear", "jbl", "anker", "bose", "asus router",
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
 
-            # Other electronics
-            "battery replacement", "power adapter", "charger only", "stylus pen", "drawing tablet",
-            "projector", "printer", "scanner", "monitor only", "screen extender", "ethernet cable",
 
-            # Toys or fake items
-            "toy", "kids laptop", "learning computer", "fake laptop", "replica laptop", "training toy",
+class RainforestAPI:
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
 
-            # Home items
-            "lamp", "fan", "calculator", "radio", "speaker only", "router", "switch", "modem"
-        ]
+    def __init__(self, api_key, connect_timeout=5, read_timeout=30, max_retries=3,
+                 backoff_base=1.0, backoff_cap=30.0, breaker: Optional[CircuitBreaker] = None,
+                 currency_rates: Optional[dict] = None, max_workers=8, max_pages=3, page_concurrency=2):
+        self.api_key = api_key
+        self.base_url =  "https://api.rainforestapi.com/request"
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        self.currency_rates = currency_rates or CURRENCY_RATES
+        self.max_pages = max(1, max_pages)
+        self.page_concurrency = max(1, page_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rainforest")
+        # Separate pool so marketplace searches can wait on their page fetches without starving
+        self._page_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rainforest-page")
+        # Every request made, kept in memory until drain_ledger() hands it to the credit ledger
+        self._ledger = []
+        self._ledger_lock = threading.Lock()
+        # Cheapest matching price per check, likewise held until drain_observations()
+        self._observations = []
+        self.credits_remaining = None  # as last reported by Rainforest
+
+    def _record_call(self, params, purpose, status, credits):
+        call = ApiCall(datetime.now().isoformat(), purpose, params.get("amazon_domain"),
+                       params.get("search_term"), credits, status)
+        with self._ledger_lock:
+            self._ledger.append(call)
+
+    def _charge(self, body) -> int:
+        """Credits a successful response cost, per its request_info (1 if it doesn't say)"""
+        info = body.get("request_info") if isinstance(body, dict) else None
+        if not info:
+            return 1
+        if info.get("credits_remaining") is not None:
+            self.credits_remaining = info["credits_remaining"]
+        return int(info.get("credits_used_this_request", 1))
+
+    def drain_ledger(self) -> List[ApiCall]:
+        """Take the calls recorded since the last drain"""
+        with self._ledger_lock:
+            calls, self._ledger = self._ledger, []
+        return calls
+
+    def _observe(self, search_query, currency, streams):
+        """Note the cheapest matching product of a check (streams are price-sorted) as a price observation"""
+        heads = [stream[0] for stream in streams if stream]
+        if not heads:
+            return
+        cheapest = min(heads, key=lambda result: result.normalized_price)
+        observation = PriceObservation(time.time(), search_query, currency, cheapest.normalized_price,
+                                       cheapest.marketplace)
+        with self._ledger_lock:
+            self._observations.append(observation)
+
+    def drain_observations(self) -> List[PriceObservation]:
+        """Take the price observations made since the last drain"""
+        with self._ledger_lock:
+            observations, self._observations = self._observations, []
+        return observations
+
+    def _backoff_delay(self, attempt, retry_after_header=None):
+        """Full-jitter exponential backoff, honouring Retry-After when Rainforest sends one."""
+        if retry_after_header:
+            try:
+                return min(self.backoff_cap, float(retry_after_header))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
 
-        for keyword in blocked_keywords:
-            if keyword in title:
-                return False
-        return True
-
-    def _clean_and_dedup_filters(self,filters):
-        normalized = [x.strip().lower() for x in filters if x and x != "Skip"]
-        seen = set()
-        deduped = []
-        for f in normalized:
-            if f not in seen:
-                deduped.append(f)
-                seen.add(f)
-        return deduped
-
-    def _parse_price(self, price_str):
+    def _request(self, params, purpose="sweep") -> Optional[dict]:
         """
-        Converts price strings like "$1,299.99" into float: 1299.99
-        Returns None if price is missing or invalid.
+        GET the Rainforest endpoint with timeouts and retries.
+        Returns the decoded JSON body, or None if the call failed.
+        Raises CircuitOpenError when the breaker is open.
+        Each attempt is recorded for the credit ledger under `purpose` ("retry" after the first).
         """
-        if price_str:
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow_request():
+                raise CircuitOpenError(self.breaker.retry_after())
+
+            call_purpose = purpose if attempt == 0 else "retry"
+            retry_after_header = None
+            # Set once the breaker has heard how this attempt went; if it never does (an error
+            # nothing here expects), the attempt still counts as a failure so it can't keep the
+            # half-open trial slot forever
+            recorded = False
             try:
-                return float(price_str.replace("$", "").replace(",", "").strip())
-            except Exception:
-                return None
+                try:
+                    response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+                except requests.RequestException as e:
+                    logger.warning("Rainforest API request failed: %s", type(e).__name__)
+                    self.breaker.record_failure()
+                    recorded = True
+                    self._record_call(params, call_purpose, None, 0)
+                else:
+                    if response.status_code == 200:
+                        self.breaker.record_success()
+                        recorded = True
+                        try:
+                            body = response.json()
+                        except ValueError:
+                            logger.warning("Rainforest API returned invalid JSON")
+                            self._record_call(params, call_purpose, response.status_code, 1)
+                            return None
+                        self._record_call(params, call_purpose, response.status_code, self._charge(body))
+                        return body
+                    if response.status_code not in self.RETRYABLE_STATUS:
+                        # Client errors (bad key, bad params) won't get better by retrying
+                        self.breaker.record_success()
+                        recorded = True
+                    else:
+                        self.breaker.record_failure()
+                        recorded = True
+                    # Rainforest doesn't bill failed requests, but they still go in the ledger
+                    self._record_call(params, call_purpose, response.status_code, 0)
+                    if response.status_code not in self.RETRYABLE_STATUS:
+                        logger.error("Rainforest API error: %s", response.status_code)
+                        return None
+                    logger.warning("Rainforest API error: %s", response.status_code)
+                    retry_after_header = response.headers.get("Retry-After")
+            finally:
+                if not recorded:
+                    self.breaker.record_failure()
+
+            if attempt < self.max_retries:
+                time.sleep(self._backoff_delay(attempt, retry_after_header))
         return None
 
-
-
-    def _search_console_product(self,category,product_name,manufacturer):
-        console_filters = []
-        random_page = random.randint(1, 5)
-
-        if manufacturer != "Skip Manufacturer":
-            console_filters.append(manufacturer.strip())
-
-        if product_name:
-            console_filters.append(product_name.strip())
-
-        if len(console_filters) < 1:
-            return None
-
-        query = ' '.join(console_filters).strip()
+    def search_product(self, category: Category, answers, amazon_domain=DEFAULT_MARKETPLACE, limit=None,
+                       query=None):
+        """
+        Onboarding search: build the query from the user's answers (or use `query` as given) and
+        return (real products from the first `limit` results (the whole page by default), search query).
+        """
+        query = query or category.build_query(answers)
+        if not query:
+            return [], None
 
         params = {
             "api_key": self.api_key,
             "type": "search",
-            "amazon_domain": "amazon.ca",
+            "amazon_domain": amazon_domain,
             "search_term": query
         }
 
-        response = requests.get(self.base_url, params=params)
+        data = self._request(params, purpose="onboarding")
+        if data is None:
+            return [], query
 
-        if response.status_code != 200:
-            print(self.api_key)
-            print("Rainforest API error:", response.status_code)
-            return None
-
-        data = response.json()
         results = data.get("search_results", [])
-
         if not results:
-            print("❌ No console products found.")
-            return None
+            logger.info("No %s products found for %r", category.name, query)
+            return [], query
 
+        query_terms = category.query_terms(query)
         valid_products = []
-        for item in results[:10]:
-            title = item.get("title", "No title")
-            if self.is_real_console_product(title):
-                valid_products.append(item)
-
-        print(valid_products)
+        for item in results[:limit]:
+            result = SearchResult.from_payload(item, amazon_domain)
+            is_real, score = category.classify(result.title, query_terms, result.tokens)
+            if is_real:
+                valid_products.append(result._replace(match_score=score))
         return valid_products, query
 
-    def _search_laptop_product(self,category,product_name,manufacturer,ram,storage,processor,price):
-        laptop_filters = []
-        if manufacturer != "Skip Manufacturer":
-            laptop_filters.append(manufacturer.strip())
-
-        if product_name:
-            laptop_filters.append(product_name.strip())
-
-        # if model != "Skip Model":
-        #     laptop_filters.append(model.strip())
-
-        if processor != "Skip Processor":
-            laptop_filters.append(processor.strip())
-
-        if ram != "Skip RAM":
-            laptop_filters.append(ram.strip())
-
-        if storage != "Skip Storage":
-            laptop_filters.append(storage.strip())
-
-        if len(laptop_filters) < 2:
-            return None
-
-        cleaned_filters = self._clean_and_dedup_filters(laptop_filters)
-
-        laptop_query = ' '.join(cleaned_filters).strip()
-
-        params = {
-            "api_key": self.api_key,
-            "type": "search",
-            "amazon_domain": "amazon.ca",
-            "search_term": laptop_query
-        }
-        response1 = requests.get(self.base_url, params=params)
-        if response1.status_code != 200:
-            print("Rainforest API error:", response1.status_code)
-            return None
-
-        data = response1.json()
-        results = data.get("search_results", [])
-        if not results:
-            print("❌ No results found.")
-            return None
-        valid_products = []
-        for i, item in enumerate(results[:10]):
-            title = item.get("title", "No title")
-            print(title)
-            if self.is_real_laptop_product(title):
-                valid_products.append(item)
-        print(valid_products,laptop_query)
-        return valid_products,laptop_query
-
-    def _search_mobile_product(self,category,product_name,manufacturer,model_name,storage,target_price):
-        filters = []
-        random_page = random.randint(1,5)
-        # if category:
-        #     category_term = self.category_keywords.get(category, "")
-        #     filters.append(category_term)
-        if manufacturer != "Skip Manufacturer":
-            filters.append(manufacturer.strip())
-
-        if product_name:
-            filters.append(product_name.strip())
-
-        if model_name != "Skip Model":
-            filters.append(model_name.strip())
-
-        if storage != "Skip Storage":
-            filters.append(storage)
-
-        if len(filters) < 2:
-            return
-
-        query = ' '.join(filters).strip()
-
+    def _fetch_page(self, search_query, amazon_domain, page):
         params = {
             "api_key": self.api_key,
             "type": "search",
-            "amazon_domain": "amazon.ca",
-            "search_term": query
+            "amazon_domain": amazon_domain,
+            "search_term": search_query,
+            "sort_by": "price_low_to_high",
+            "page": page
         }
+        return self._request(params)
 
-        response = requests.get(self.base_url, params=params)
-
-        if response.status_code != 200:
-            print("Rainforest API error:", response.status_code)
-            return None
-
-        data = response.json()
-        results = data.get("search_results", [])
-
-        if not results:
-            print("❌ No results found.")
-            return None
-        valid_products = []
-        for i, item in enumerate(results[:10]):
-            title = item.get("title", "No title")
-            if self.is_real_mobile_product(title):
-                valid_products.append(item)
-        print(valid_products)
-        return valid_products,query
-
-
-
-    def track_product(self,search_query,target_price,categoty):
-        params = {
-            "api_key": self.api_key,
-            "type": "search",
-            "amazon_domain": "amazon.ca",
-            "search_term": search_query
-        }
-
-        response = requests.get(self.base_url, params=params)
-
-        if response.status_code != 200:
-            print("Rainforest API error:", response.status_code)
-            return None
-
-        search_data = response.json()
+    def _page_products(self, search_data, category: Category, query_terms, amazon_domain, currency):
+        """
+        Returns (matching products priced in `currency`, price of the cheapest real product or None,
+        number of results on the page).
+        """
         search_products = search_data.get("search_results", [])
-        print(f"🔍 Query: {search_query}")
-        print(f"Found {len(search_products)} products.")
-
-        if not search_products:
-            print("❌ No results found.")
-            return None
-        valid_products = []
-        if categoty ==  "Phones":
-            for index in range(0,len(search_products)):
-                title = search_products[index].get("title", "No title")
-                if self.is_real_mobile_product(title):
-                    valid_products.append(search_products[index])
-        elif categoty == "Laptops":
-            for index in range(0,len(search_products)):
-                title = search_products[index].get("title", "No title")
-                if self.is_real_laptop_product(title):
-                    valid_products.append(search_products[index])
-        elif categoty == "Gaming":
-            for index in range(0,len(search_products)):
-                title = search_products[index].get("title", "No title")
-                if self.is_real_console_product(title):
-                    valid_products.append(search_products[index])
-        print(f"found {len(valid_products)} valid products")
-        sorted_lst = self.merge_sort(valid_products)
-        target_results = []
-        for items in sorted_lst:
-            current_price = items.get("price")
-            if isinstance(current_price,dict):
-                current_price = current_price.get("value")
-            else:
-                current_price = None
-
-            if current_price is None:
+        # Checked once per page, not per title; DebugSampler thins out what gets through
+        debug = logger.isEnabledFor(logging.DEBUG)
+        matched_products = []
+        cheapest_valid = None
+        for item in search_products:
+            result = SearchResult.from_payload(item, amazon_domain)
+            is_real, score = category.classify(result.title, query_terms, result.tokens)
+            if debug:
+                logger.debug("Title %r: real=%s score=%.2f", result.title, is_real, score)
+            if not is_real or result.price is None:
                 continue
+            item_currency = result.currency if result.currency in self.currency_rates else MARKETPLACES[amazon_domain]
+            normalized_price = convert_price(result.price, item_currency, currency, self.currency_rates)
+            if cheapest_valid is None or normalized_price < cheapest_valid:
+                cheapest_valid = normalized_price
+            if not category.is_match(score):
+                continue
+            matched_products.append(result._replace(normalized_price=normalized_price, match_score=score))
+        return matched_products, cheapest_valid, len(search_products)
 
-            if current_price <= target_price:
-                target_results.append(items)
-            else:
+    def _search_marketplace(self, search_query, category: Category, amazon_domain, currency, target_price,
+                            profiler=NULL_PROFILER):
+        """
+        Search one marketplace, cheapest first, and return the products that pass the
+        category filter and match the query, sorted by price in `currency`.
+        Page 1 is fetched alone; further pages are fetched `page_concurrency` at a time
+        until `max_pages`, the last page, or a page whose cheapest real product is
+        already above `target_price`.
+        """
+        with profiler.stage("fetch"):
+            search_data = self._fetch_page(search_query, amazon_domain, 1)
+        if search_data is None:
+            return []
+
+        total_pages = search_data.get("pagination", {}).get("total_pages") or self.max_pages
+        last_page = min(self.max_pages, total_pages)
+        query_terms = category.query_terms(search_query)
+
+        priced_products = []
+        pages = [search_data]
+        next_page = 2
+        while True:
+            finished = False
+            for page_data in pages:
+                if page_data is None:
+                    finished = True
+                    break
+                with profiler.stage("filter"):
+                    products, cheapest_valid, result_count = self._page_products(
+                        page_data, category, query_terms, amazon_domain, currency)
+                priced_products.extend(products)
+                if result_count == 0 or (cheapest_valid is not None and cheapest_valid > target_price):
+                    finished = True
+                    break
+            if finished or next_page > last_page:
+                break
+            wave = range(next_page, min(last_page, next_page + self.page_concurrency - 1) + 1)
+            with profiler.stage("fetch"):
+                pages = list(self._page_pool.map(
+                    lambda page: self._fetch_page(search_query, amazon_domain, page), wave))
+            next_page = wave.stop
+
+        logger.info("Query %r (%s): %d matching products from %d page(s)",
+                    search_query, amazon_domain, len(priced_products), next_page - 1,
+                    extra={"query": search_query, "marketplace": amazon_domain,
+                           "matches": len(priced_products), "pages": next_page - 1})
+        with profiler.stage("sort"):
+            priced_products.sort(key=lambda result: result.normalized_price)
+        return priced_products
+
+    def track_product(self, search_query, target_price, category: Category,
+                      marketplaces: Optional[Iterable[str]] = None, currency="CAD", profiler=NULL_PROFILER):
+        """
+        Search every marketplace concurrently and return the matching products at or below
+        `target_price` (in `currency`), cheapest first across all marketplaces.
+        Pass a metrics.SweepProfiler as `profiler` to time the fetch/filter/sort stages.
+        """
+        domains = list(dict.fromkeys(marketplaces or [DEFAULT_MARKETPLACE]))
+        futures = [
+            self._pool.submit(self._search_marketplace, search_query, category, domain, currency, target_price,
+                              profiler)
+            for domain in domains
+        ]
+        streams = [future.result() for future in futures]
+        self._observe(search_query, currency, streams)
+        with profiler.stage("sort"):
+            return self._merge_streams(streams, target_price)
+
+    @staticmethod
+    def _merge_streams(streams, target_price):
+        """Each stream is already price-sorted, so a k-way merge lets us stop at the first item over target"""
+        target_results = []
+        for result in heapq.merge(*streams, key=lambda result: result.normalized_price):
+            if result.normalized_price > target_price:
                 break
+            target_results.append(result)
         return target_results
 
-
-
-
+    def track_products_batch(self, checks, runner, profiler=NULL_PROFILER):
+        """
+        Sweep version of track_product: `checks` are (key, search_query, target_price, category,
+        marketplaces, currency). Each round submits the next page of every search still open as
+        one batch job through `runner` (see rainforest_batch), with the same stopping rules as
+        _search_marketplace. Yields (key, results) for a check as soon as all its marketplaces
+        are done, `results` being what track_product would have returned.
+        """
+        checks = list(checks)
+        query_terms = [category.query_terms(query) for _, query, _, category, _, _ in checks]
+        found = [{} for _ in checks]
+        domains_left = []
+        open_searches = {}  # custom_id -> (check index, domain, page, last page)
+        for index, (_, _, _, _, marketplaces, _) in enumerate(checks):
+            domains = list(dict.fromkeys(marketplaces or [DEFAULT_MARKETPLACE]))
+            domains_left.append(set(domains))
+            for domain in domains:
+                open_searches[f"{index}:{domain}"] = (index, domain, 1, self.max_pages)
+
+        while open_searches:
+            batch = [{
+                "type": "search",
+                "amazon_domain": domain,
+                "search_term": checks[index][1],
+                "sort_by": "price_low_to_high",
+                "page": page,
+                "custom_id": custom_id,
+            } for custom_id, (index, domain, page, _) in open_searches.items()]
+            still_open = {}
+            answered = set()
+            stream = iter(runner.run(batch))
+            while True:
+                with profiler.stage("fetch"):
+                    item = next(stream, None)
+                if item is None:
+                    break
+                custom_id, search_data = item
+                if custom_id not in open_searches or custom_id in answered:
+                    continue
+                answered.add(custom_id)
+                index, domain, page, last_page = open_searches[custom_id]
+                key, search_query, target_price, category, _, currency = checks[index]
+                if not runner.records_calls:
+                    request = {"amazon_domain": domain, "search_term": search_query}
+                    self._record_call(request, "sweep", 200 if search_data else None,
+                                      self._charge(search_data) if search_data else 0)
+                done = search_data is None
+                if not done:
+                    if page == 1:
+                        total_pages = search_data.get("pagination", {}).get("total_pages") or self.max_pages
+                        last_page = min(self.max_pages, total_pages)
+                    with profiler.stage("filter"):
+                        products, cheapest_valid, result_count = self._page_products(
+                            search_data, category, query_terms[index], domain, currency)
+                    found[index].setdefault(domain, []).extend(products)
+                    done = (result_count == 0 or page >= last_page
+                            or (cheapest_valid is not None and cheapest_valid > target_price))
+                if not done:
+                    still_open[custom_id] = (index, domain, page + 1, last_page)
+                    continue
+                domains_left[index].discard(domain)
+                if not domains_left[index]:
+                    yield key, self._finish_check(found[index], search_query, target_price, currency, profiler)
+
+            # Anything the batch didn't answer is treated as a failed search
+            for custom_id in open_searches.keys() - answered:
+                index, domain, _, _ = open_searches[custom_id]
+                domains_left[index].discard(domain)
+                if not domains_left[index]:
+                    key, search_query, target_price, _, _, currency = checks[index]
+                    yield key, self._finish_check(found[index], search_query, target_price, currency, profiler)
+            open_searches = still_open
+
+    def _finish_check(self, found_by_domain, search_query, target_price, currency, profiler):
+        with profiler.stage("sort"):
+            streams = [sorted(products, key=lambda result: result.normalized_price)
+                       for products in found_by_domain.values()]
+            self._observe(search_query, currency, streams)
+            return self._merge_streams(streams, target_price)
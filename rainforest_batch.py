@@ -0,0 +1,118 @@
+import time
+import logging
+from typing import Iterator, List, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class BatchError(Exception):
+    """A batch job could not be created, run or read back"""
+
+
+class RainforestCollections:
+    """
+    Runs a batch of search requests as a Rainforest collection: create it, add the requests
+    (up to 1000 per call), start it, poll until it has run, then stream the result pages.
+    Every request carries a `custom_id` that comes back with its result.
+    """
+
+    base_url = "https://api.rainforestapi.com/collections"
+    max_requests_per_call = 1000
+    # Results come back without going through RainforestAPI._request, so the caller bills them
+    records_calls = False
+
+    def __init__(self, api_key: str, session: requests.Session = None, poll_interval: float = 10.0,
+                 timeout: float = 1800.0, http_timeout: Tuple[float, float] = (5, 60)):
+        self.api_key = api_key
+        self.session = session or requests.Session()
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.http_timeout = http_timeout
+
+    def _call(self, method: str, path: str = "", **kwargs) -> dict:
+        try:
+            response = self.session.request(method, self.base_url + path, params={"api_key": self.api_key},
+                                            timeout=self.http_timeout, **kwargs)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise BatchError(f"Collections request failed: {type(e).__name__}") from e
+        if response.status_code != 200:
+            raise BatchError(f"Collections API error: {response.status_code}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise BatchError("Collections API returned invalid JSON") from e
+
+    def run(self, batch: List[dict]) -> Iterator[Tuple[str, dict]]:
+        """Yield (custom_id, search response) for each request in `batch` once the collection has run"""
+        created = self._call("POST", json={"name": f"price-sweep-{int(time.time())}",
+                                           "schedule_type": "manual", "priority": "normal"})
+        collection_id = created.get("collection", {}).get("id")
+        if not collection_id:
+            raise BatchError("Collections API did not return a collection id")
+        try:
+            for start in range(0, len(batch), self.max_requests_per_call):
+                self._call("PUT", f"/{collection_id}",
+                           json={"requests": batch[start:start + self.max_requests_per_call]})
+            self._call("GET", f"/{collection_id}/start")
+            self._wait(collection_id)
+            results = self._call("GET", f"/{collection_id}/results").get("results", [])
+            for result_set in results:
+                for page_url in result_set.get("download_links", {}).get("json", {}).get("pages", []):
+                    yield from self._read_page(page_url)
+        finally:
+            try:
+                self._call("DELETE", f"/{collection_id}")
+            except BatchError as e:
+                logger.warning("Could not delete collection %s: %s", collection_id, e)
+
+    def _wait(self, collection_id: str):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            time.sleep(self.poll_interval)
+            status = self._call("GET", f"/{collection_id}").get("collection", {}).get("status")
+            # A manual collection goes back to "idle" once its run has finished
+            if status == "idle":
+                return
+            if time.monotonic() > deadline:
+                raise BatchError(f"Collection {collection_id} still {status} after {self.timeout}s")
+
+    def _read_page(self, page_url: str) -> Iterator[Tuple[str, dict]]:
+        try:
+            response = self.session.get(page_url, timeout=self.http_timeout)
+            entries = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise BatchError(f"Could not download collection results: {e}") from e
+        for entry in entries:
+            custom_id = entry.get("request", {}).get("custom_id")
+            if custom_id is None:
+                continue
+            yield custom_id, (entry.get("result") if entry.get("success") else None)
+
+
+class LocalBatchRunner:
+    """
+    Stand-in for RainforestCollections that answers each request in the batch one by one
+    through `fetch(params) -> response or None`. Use it in tests (with a fake fetch), or to
+    exercise the batch sweep path without a collections-enabled Rainforest plan.
+    """
+
+    records_calls = True  # fetch goes through RainforestAPI._request, which records each call
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+
+    def run(self, batch: List[dict]) -> Iterator[Tuple[str, dict]]:
+        for request in batch:
+            params = {k: v for k, v in request.items() if k != "custom_id"}
+            yield request["custom_id"], self.fetch(params)
+
+
+def make_batch_runner(mode: str, rainforest):
+    """Batch runner for RAINFOREST_BATCH=collections|local, or None to check queries one by one"""
+    if mode == "collections":
+        return RainforestCollections(rainforest.api_key, rainforest.session)
+    if mode == "local":
+        return LocalBatchRunner(lambda params: rainforest._request({"api_key": rainforest.api_key, **params}))
+    return None
@@ -0,0 +1,61 @@
+import zlib
+from typing import Dict, Hashable, List, Set
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel over one check interval, split into `slots` ticks.
+
+    Each entry sits in the slot its group key hashes to, a stable pseudo-random offset
+    into the interval, so a query comes up at the same point of every rotation and checks
+    are spread evenly over the interval instead of all firing at its start. Entries with
+    the same group key (trackings sharing a search) land in the same slot and are still
+    checked with one call. Slots are anchored to the epoch, so a restarted process keeps
+    the same schedule.
+    """
+
+    def __init__(self, interval: float = 3600, slots: int = 60):
+        self.interval = interval
+        self.slots = slots
+        self.tick = interval / slots
+        self._buckets: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._slot_of: Dict[Hashable, int] = {}
+
+    def slot_for(self, group_key: str) -> int:
+        return zlib.crc32(group_key.encode()) % self.slots
+
+    def slot_at(self, timestamp: float) -> int:
+        """The slot whose tick contains `timestamp` (seconds since the epoch)"""
+        return int(timestamp % self.interval // self.tick)
+
+    def until_next_tick(self, timestamp: float) -> float:
+        return self.tick - timestamp % self.tick
+
+    def slots_between(self, after: int, upto: int) -> List[int]:
+        """Slots after `after` up to and including `upto`, wrapping around the wheel"""
+        return [(after + step) % self.slots for step in range(1, (upto - after) % self.slots + 1)]
+
+    def add(self, entry: Hashable, group_key: str) -> int:
+        """Place `entry` (or move it, if its group key changed); returns its slot"""
+        self.discard(entry)
+        slot = self.slot_for(group_key)
+        self._buckets[slot].add(entry)
+        self._slot_of[entry] = slot
+        return slot
+
+    def discard(self, entry: Hashable):
+        slot = self._slot_of.pop(entry, None)
+        if slot is not None:
+            self._buckets[slot].discard(entry)
+
+    def entries(self, slot: int) -> List[Hashable]:
+        return list(self._buckets[slot])
+
+    def keys(self) -> List[Hashable]:
+        return list(self._slot_of)
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, entry: Hashable) -> bool:
+        return entry in self._slot_of
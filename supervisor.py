@@ -0,0 +1,135 @@
+import json
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TaskSupervisor:
+    """
+    Owns a long-running coroutine and keeps it running.
+
+    If the coroutine returns or raises it is restarted after an exponential backoff, which
+    resets once a run has lasted `healthy_after` seconds. The coroutine reports its schedule
+    with beat(next_due_at, lag); if its next beat is more than `stall_after` seconds overdue
+    (hung on a call that never comes back) it is cancelled and restarted as well. How late a
+    past run started doesn't count: catching up after downtime starts late, but isn't stuck.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Awaitable], backoff_base: float = 1.0,
+                 backoff_cap: float = 300.0, stall_after: float = 1800.0, healthy_after: float = 600.0,
+                 poll_interval: float = 5.0):
+        self.name = name
+        self.factory = factory
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.stall_after = stall_after
+        self.healthy_after = healthy_after
+        self.poll_interval = poll_interval
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.next_due_at: Optional[float] = None
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def beat(self, next_due_at: float, lag: float):
+        """Called by the task at each scheduled run: when the next one is due, and how late this one started"""
+        self.next_due_at = next_due_at
+        self.last_lag = lag
+
+    def lag(self) -> float:
+        """Seconds the next beat is overdue (0 while it isn't due yet)"""
+        if self.next_due_at is None:
+            return 0.0
+        return max(0.0, time.time() - self.next_due_at)
+
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def run(self):
+        failures = 0
+        while not self._stopping:
+            self.started_at = time.time()
+            # A fresh run is due to beat straight away, so one that hangs before its first beat
+            # still counts as stalled; the last run's lag says nothing about this one
+            self.next_due_at = self.started_at
+            self.last_lag = 0.0
+            self._task = asyncio.create_task(self.factory())
+            reason = await self._watch(self._task)
+            if self._stopping:
+                return
+            ran_for = time.time() - self.started_at
+            failures = 1 if ran_for >= self.healthy_after else failures + 1
+            delay = min(self.backoff_cap, self.backoff_base * 2 ** (failures - 1)) * random.uniform(0.5, 1.0)
+            self.restarts += 1
+            logger.error("%s %s, restarting in %.1fs (restart %d)", self.name, reason, delay, self.restarts,
+                         extra={"restarts": self.restarts, "schedule_lag": self.lag()})
+            await asyncio.sleep(delay)
+
+    async def _watch(self, task: asyncio.Task) -> str:
+        """Wait for `task` to end or stall; returns what happened"""
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=self.poll_interval)
+            if done:
+                if task.cancelled():
+                    self.last_error = "cancelled"
+                    return "was cancelled"
+                error = task.exception()
+                self.last_error = repr(error) if error else "exited"
+                return f"crashed: {error!r}" if error else "exited"
+            lag = self.lag()
+            if lag > self.stall_after:
+                self.last_error = f"stalled {lag:.0f}s behind schedule"
+                task.cancel()
+                # A task stuck in a worker thread can't be interrupted, only abandoned
+                await asyncio.wait({task}, timeout=self.poll_interval)
+                return self.last_error
+
+    async def stop(self):
+        self._stopping = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.wait({self._task}, timeout=self.poll_interval)
+
+    def status(self) -> Dict:
+        return {
+            "task": self.name,
+            "running": self.running(),
+            "lag_seconds": round(self.lag(), 1),
+            "last_start_lag_seconds": round(self.last_lag, 1),
+            "next_due_at": datetime.fromtimestamp(self.next_due_at).isoformat() if self.next_due_at else None,
+            "restarts": self.restarts,
+            "last_error": self.last_error,
+            "up_seconds": round(time.time() - self.started_at, 1) if self.started_at and self.running() else 0.0,
+        }
+
+
+async def serve_health(supervisor: TaskSupervisor, port: int, max_lag: float = 600.0,
+                       host: str = "0.0.0.0") -> asyncio.AbstractServer:
+    """
+    Minimal HTTP health endpoint (any path): 200 while the supervised task is running and its
+    next beat is at most `max_lag` seconds overdue, 503 otherwise, with supervisor.status() as JSON.
+    If the event loop itself is blocked this stops answering, which the platform also treats as down.
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            status = supervisor.status()
+            status["healthy"] = status["running"] and status["lag_seconds"] <= max_lag
+            body = json.dumps(status).encode()
+            head = (f"HTTP/1.1 {'200 OK' if status['healthy'] else '503 Service Unavailable'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+            writer.write(head.encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -1,13 +1,71 @@
 import sqlite3
-from typing import List, Dict, Optional
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Iterable, Tuple
 import json
 from datetime import datetime
 
+from categories import clean_text
+from models import Tracking, ApiCall, PriceObservation, KnownProduct
+
+# Row-value lookups are chunked to stay well under SQLite's bound-parameter limit
+_KEY_CHUNK = 400
+
+
 class UserManager:
-    def __init__(self, connection: sqlite3.Connection):
+    def __init__(self, connection: sqlite3.Connection, init_db: bool = True, read_pool=None):
         self.conn = connection
-        self._init_db()
+        self.read_pool = read_pool
+        self._group_depth = 0
+        self._savepoint_id = 0
+        if init_db:
+            self._init_db()
 
+    @contextmanager
+    def _transaction(self):
+        """
+        Commit (or roll back) the enclosed statements. Inside group_commit() the
+        statements get a savepoint instead and the group owns the COMMIT.
+        """
+        if not self._group_depth:
+            with self.conn:
+                yield
+            return
+        self._savepoint_id += 1
+        savepoint = f"op_{self._savepoint_id}"
+        self.conn.execute(f"SAVEPOINT {savepoint}")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute(f"ROLLBACK TO {savepoint}")
+            self.conn.execute(f"RELEASE {savepoint}")
+            raise
+        self.conn.execute(f"RELEASE {savepoint}")
+
+    @contextmanager
+    def _reading(self):
+        """Connection for a read: one from the read pool if there is one, else the main connection"""
+        if self.read_pool is None or self._group_depth:
+            yield self.conn
+        else:
+            with self.read_pool.connection() as conn:
+                yield conn
+
+    @contextmanager
+    def group_commit(self):
+        """Run several operations as one transaction with a single COMMIT at the end"""
+        if self._group_depth == 0:
+            self.conn.execute("BEGIN")
+        self._group_depth += 1
+        try:
+            yield
+        except BaseException:
+            self._group_depth -= 1
+            if self._group_depth == 0:
+                self.conn.rollback()
+            raise
+        self._group_depth -= 1
+        if self._group_depth == 0:
+            self.conn.commit()
 
     def _init_db(self):
         self.conn.execute('''
@@ -17,83 +75,470 @@ class UserManager:
                 target_price REAL,
                 sku TEXT,
                 product_data TEXT,  -- Keep JSON data
+                name_key TEXT,  -- normalized product_name for /stop lookups
+                last_checked_at TEXT,  -- when a sweep last checked this tracking's price
                 PRIMARY KEY (user_id, product_name))
         ''')
+        self._migrate_name_key()
+        self._migrate_last_checked_at()
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_trackings_user_name_key
+            ON trackings (user_id, name_key)
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id INTEGER PRIMARY KEY,
+                marketplaces TEXT  -- JSON list, first entry is the home marketplace
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS alert_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE,
+                user_id INTEGER,
+                payload TEXT,  -- JSON message to deliver
+                created_at TEXT,
+                sent_at TEXT
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_alert_outbox_pending
+            ON alert_outbox (sent_at, id)
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS api_calls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                called_at TEXT,
+                purpose TEXT,  -- onboarding, sweep or retry
+                amazon_domain TEXT,
+                search_term TEXT,
+                credits INTEGER,
+                status INTEGER
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_api_calls_called_at
+            ON api_calls (called_at)
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS price_observations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                observed_at REAL,  -- Unix seconds
+                search_query TEXT,
+                currency TEXT,
+                price REAL,  -- cheapest matching product, in `currency`
+                marketplace TEXT
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_price_observations_query
+            ON price_observations (search_query, currency, observed_at)
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS media_cache (
+                key TEXT PRIMARY KEY,  -- "asin:<ASIN>" or "url:<image URL>"
+                file_id TEXT,  -- Telegram file_id of the uploaded photo
+                stored_at REAL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS products (
+                asin TEXT PRIMARY KEY,
+                title TEXT,
+                price REAL,
+                currency TEXT,
+                link TEXT,
+                image TEXT,
+                marketplace TEXT,
+                category TEXT,
+                search_query TEXT,  -- the onboarding search that found it
+                seen_at REAL  -- Unix seconds
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_products_seen_at
+            ON products (seen_at)
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS sweep_state (
+                name TEXT PRIMARY KEY,
+                value TEXT  -- JSON
+            )
+        ''')
         self.conn.commit()
 
+    def _migrate_name_key(self):
+        """Add and backfill name_key on databases created before it existed"""
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(trackings)")]
+        if "name_key" not in columns:
+            self.conn.execute("ALTER TABLE trackings ADD COLUMN name_key TEXT")
+        rows = self.conn.execute('''
+            SELECT user_id, product_name FROM trackings WHERE name_key IS NULL
+        ''').fetchall()
+        self.conn.executemany('''
+            UPDATE trackings SET name_key=? WHERE user_id=? AND product_name=?
+        ''', [(clean_text(name), user_id, name) for user_id, name in rows])
+
+    def _migrate_last_checked_at(self):
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(trackings)")]
+        if "last_checked_at" not in columns:
+            self.conn.execute("ALTER TABLE trackings ADD COLUMN last_checked_at TEXT")
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_trackings_last_checked_at
+            ON trackings (last_checked_at)
+        ''')
+
     def add_tracking(self, user_id: int, product_name: str,
                      target_price: float, sku: str, product_data: dict):
-        self.conn.execute('''
-            INSERT OR REPLACE INTO trackings
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            product_name,
-            target_price,
-            sku,
-            json.dumps(product_data),
-            # datetime.now().isoformat()  # Keep JSON storage
-        ))
-        self.conn.commit()
+        self.add_trackings([{
+            'user_id': user_id,
+            'product_name': product_name,
+            'target_price': target_price,
+            'sku': sku,
+            'product_data': product_data
+        }])
 
-    def get_all_trackings(self) -> List[Dict]:
-        """Get all tracked items for all users"""
-        cursor = self.conn.execute('''
-            SELECT user_id, product_name, target_price, sku, product_data
-            FROM trackings
-        ''')
-        return [{
-            'user_id': row[0],
-            'product_name': row[1],
-            'target_price': row[2],
-            'sku': row[3],
-            'product_data': json.loads(row[4])  # Convert JSON string to dict
-        } for row in cursor.fetchall()]
+    def _existing_keys(self, keys: List[Tuple[int, str]]) -> set:
+        """Which (user_id, product_name) pairs already have a tracking"""
+        existing = set()
+        for start in range(0, len(keys), _KEY_CHUNK):
+            chunk = keys[start:start + _KEY_CHUNK]
+            placeholders = ", ".join(["(?, ?)"] * len(chunk))
+            cursor = self.conn.execute(f'''
+                SELECT user_id, product_name FROM trackings
+                WHERE (user_id, product_name) IN (VALUES {placeholders})
+            ''', [value for key in chunk for value in key])
+            existing.update(cursor.fetchall())
+        return existing
 
+    def _delete_trackings(self, keys: List[Tuple[int, str]]) -> List[bool]:
+        """DELETE the given pairs (caller owns the transaction); returns whether each one existed"""
+        existing = self._existing_keys(keys)
+        self.conn.executemany('''
+            DELETE FROM trackings
+            WHERE user_id=? AND product_name=?
+        ''', keys)
+        # A pair listed twice only counts as removed the first time
+        results = []
+        for key in keys:
+            results.append(key in existing)
+            existing.discard(key)
+        return results
 
+    def add_trackings(self, items: Iterable[Dict]) -> List[bool]:
+        """
+        Insert or replace many trackings in one transaction.
+        Each item has user_id, product_name, target_price, sku and product_data.
+        Returns, per item, True if it created a new tracking and False if it replaced one.
+        """
+        rows = [(
+            item['user_id'],
+            item['product_name'],
+            item['target_price'],
+            item.get('sku', ""),
+            json.dumps(item.get('product_data', {})),
+            clean_text(item['product_name'])
+        ) for item in items]
+        keys = [(row[0], row[1]) for row in rows]
+        with self._transaction():
+            existing = self._existing_keys(keys)
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO trackings
+                    (user_id, product_name, target_price, sku, product_data, name_key)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+        results = []
+        for key in keys:
+            results.append(key not in existing)
+            existing.add(key)
+        return results
 
-    def remove_tracking(self, user_id: int, product_name: str) -> bool:
-        cursor = self.conn.execute('''
-            SELECT product_name FROM trackings WHERE user_id=?
-        ''', (user_id,))
-        rows = cursor.fetchall()
-
-        matched_name = None
-        for row in rows:
-            saved_name = row[0].lower()
-            if product_name.lower() in saved_name:
-                matched_name = row[0]
-                break
-
-        if matched_name:
-            self.conn.execute('''
-                DELETE FROM trackings
+    def update_target_prices(self, updates: Iterable[Tuple[int, str, float]]) -> List[bool]:
+        """
+        Change the target price of many (user_id, product_name, target_price) trackings
+        in one transaction. Returns, per update, whether the tracking exists.
+        """
+        updates = list(updates)
+        keys = [(user_id, product_name) for user_id, product_name, _ in updates]
+        with self._transaction():
+            existing = self._existing_keys(keys)
+            self.conn.executemany('''
+                UPDATE trackings SET target_price=?
                 WHERE user_id=? AND product_name=?
-            ''', (user_id, matched_name))
-            self.conn.commit()
-            return True
+            ''', [(target_price, user_id, product_name) for user_id, product_name, target_price in updates])
+        return [key in existing for key in keys]
 
-        return False
+    def remove_trackings(self, keys: Iterable[Tuple[int, str]]) -> List[bool]:
+        """
+        Remove many (user_id, product_name) trackings by exact name in one transaction.
+        Returns, per pair, whether a tracking was removed.
+        """
+        keys = [tuple(key) for key in keys]
+        with self._transaction():
+            return self._delete_trackings(keys)
 
-    def get_tracked_items(self, user_id: int) -> List[Dict]:
-        cursor = self.conn.execute('''
-            SELECT product_name, target_price, product_data
+    def get_all_trackings(self) -> List[Tracking]:
+        """Get all tracked items for all users"""
+        with self._reading() as conn:
+            rows = conn.execute('''
+                SELECT user_id, product_name, target_price, sku, product_data
+                FROM trackings
+            ''').fetchall()
+        return [Tracking.from_row(*row) for row in rows]
+
+    def get_due_trackings(self, due_before: str,
+                          keys: Optional[List[Tuple[int, str]]] = None) -> List[Tracking]:
+        """
+        Trackings never checked, or last checked before `due_before` (ISO timestamp).
+        With `keys`, only those (user_id, product_name) pairs are considered.
+        """
+        query = '''
+            SELECT user_id, product_name, target_price, sku, product_data
             FROM trackings
-            WHERE user_id=?
-        ''', (user_id,))
+            WHERE (last_checked_at IS NULL OR last_checked_at < ?)
+        '''
+        with self._reading() as conn:
+            if keys is None:
+                rows = conn.execute(query, (due_before,)).fetchall()
+            else:
+                rows = []
+                for start in range(0, len(keys), _KEY_CHUNK):
+                    chunk = keys[start:start + _KEY_CHUNK]
+                    placeholders = ", ".join(["(?, ?)"] * len(chunk))
+                    rows += conn.execute(query + f" AND (user_id, product_name) IN (VALUES {placeholders})",
+                                         [due_before] + [value for key in chunk for value in key]).fetchall()
+        return [Tracking.from_row(*row) for row in rows]
 
+    def find_trackings(self, user_id: int, product_name: str, limit: int = 10) -> List[Dict]:
+        """
+        A user's trackings whose name contains `product_name` (ignoring case and punctuation),
+        best match first: exact name, then name starting with it; only if neither exists,
+        names with a word starting with it, then anywhere. Shorter names first within each group.
+        """
+        with self._reading() as conn:
+            return self._find_trackings(conn, user_id, product_name, limit)
+
+    def _find_trackings(self, conn, user_id: int, product_name: str, limit: int) -> List[Dict]:
+        name_key = clean_text(product_name)
+        if not name_key:
+            return []
+        # Exact and prefix matches are a range on idx_trackings_user_name_key; U+10FFFF sorts
+        # after any character clean_text can produce
+        params = {'user_id': user_id, 'key': name_key, 'upper': name_key + '\U0010ffff', 'limit': limit}
+        rows = conn.execute('''
+            SELECT product_name, target_price, CASE WHEN name_key = :key THEN 0 ELSE 1 END AS rank
+            FROM trackings
+            WHERE user_id = :user_id AND name_key >= :key AND name_key < :upper
+            ORDER BY rank, length(name_key), product_name
+            LIMIT :limit
+        ''', params).fetchall()
+        if not rows:
+            # Substring matches can't use the index: scan the user's trackings
+            rows = conn.execute('''
+                SELECT product_name, target_price,
+                    CASE WHEN name_key LIKE '% ' || :key || '%' THEN 2 ELSE 3 END AS rank
+                FROM trackings
+                WHERE user_id = :user_id AND instr(name_key, :key) > 0
+                ORDER BY rank, length(name_key), product_name
+                LIMIT :limit
+            ''', params).fetchall()
         return [{
             'name': row[0],
             'target_price': row[1],
-            'data': json.loads(row[2])  # Convert JSON back to dict
-        } for row in cursor.fetchall()]
+            'rank': row[2]
+        } for row in rows]
+
+    def remove_tracking(self, user_id: int, product_name: str) -> bool:
+        """Remove the tracking `product_name` refers to, if it refers to exactly one"""
+        # Resolve on the write connection so it sees this transaction's own changes
+        matches = self._find_trackings(self.conn, user_id, product_name, limit=2)
+        if not matches:
+            return False
+        if len(matches) > 1 and matches[0]['rank'] != 0:
+            return False
+        return self.remove_tracking_by_name(user_id, matches[0]['name'])
+
+    def get_tracked_items(self, user_id: int) -> List[Tracking]:
+        with self._reading() as conn:
+            rows = conn.execute('''
+                SELECT user_id, product_name, target_price, sku, product_data
+                FROM trackings
+                WHERE user_id=?
+            ''', (user_id,)).fetchall()
+        return [Tracking.from_row(*row) for row in rows]
 
     def remove_tracking_by_name(self, user_id: int, product_name: str):
         """Remove tracking by exact product name match"""
-        self.conn.execute('''
-            DELETE FROM trackings
-            WHERE user_id=? AND product_name=?
-        ''', (user_id, product_name))
-        self.conn.commit()
-        return self.conn.total_changes > 0
+        with self._transaction():
+            cursor = self.conn.execute('''
+                DELETE FROM trackings
+                WHERE user_id=? AND product_name=?
+            ''', (user_id, product_name))
+        return cursor.rowcount > 0
+
+    def get_marketplaces(self, user_id: int) -> Optional[List[str]]:
+        """Marketplaces the user searches, home marketplace first (None if never set)"""
+        with self._reading() as conn:
+            row = conn.execute('''
+                SELECT marketplaces FROM user_settings WHERE user_id=?
+            ''', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_marketplaces(self, user_id: int, marketplaces: List[str]):
+        with self._transaction():
+            self.conn.execute('''
+                INSERT OR REPLACE INTO user_settings (user_id, marketplaces)
+                VALUES (?, ?)
+            ''', (user_id, json.dumps(marketplaces)))
+
+    def record_deals(self, messages: List[Dict], finished: List[tuple], checked: Iterable[tuple] = (),
+                     checked_at: Optional[str] = None) -> int:
+        """
+        Queue alert messages in the outbox, stop the trackings they close and mark the
+        `checked` trackings as checked at `checked_at`, all in one transaction, so a sweep
+        checkpoint never records a check without its alerts. `messages` are dicts with
+        'idempotency_key', 'user_id' and 'payload'; `finished` and `checked` hold
+        (user_id, product_name) pairs.
+        Returns the number of messages queued (keys already in the outbox are skipped).
+        """
+        now = datetime.now().isoformat()
+        with self._transaction():
+            self.conn.executemany('''
+                UPDATE trackings SET last_checked_at=?
+                WHERE user_id=? AND product_name=?
+            ''', [(checked_at or now, user_id, product_name) for user_id, product_name in checked])
+            before = self.conn.total_changes
+            self.conn.executemany('''
+                INSERT OR IGNORE INTO alert_outbox (idempotency_key, user_id, payload, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', [(m['idempotency_key'], m['user_id'], json.dumps(m['payload']), now) for m in messages])
+            queued = self.conn.total_changes - before
+            self.conn.executemany('''
+                DELETE FROM trackings
+                WHERE user_id=? AND product_name=?
+            ''', [tuple(key) for key in finished])
+        return queued
+
+    def get_pending_alerts(self, limit: int = 50) -> List[Dict]:
+        with self._reading() as conn:
+            rows = conn.execute('''
+                SELECT id, idempotency_key, user_id, payload
+                FROM alert_outbox
+                WHERE sent_at IS NULL
+                ORDER BY id
+                LIMIT ?
+            ''', (limit,)).fetchall()
+        return [{
+            'id': row[0],
+            'idempotency_key': row[1],
+            'user_id': row[2],
+            'payload': json.loads(row[3])
+        } for row in rows]
+
+    def mark_alerts_sent(self, alert_ids: List[int]):
+        """Mark a batch of delivered outbox rows as sent with a single commit"""
+        now = datetime.now().isoformat()
+        with self._transaction():
+            self.conn.executemany('''
+                UPDATE alert_outbox SET sent_at=? WHERE id=? AND sent_at IS NULL
+            ''', [(now, alert_id) for alert_id in alert_ids])
+
+    def record_api_calls(self, calls: List[ApiCall]):
+        """Append a batch of Rainforest calls to the credit ledger"""
+        with self._transaction():
+            self.conn.executemany('''
+                INSERT INTO api_calls (called_at, purpose, amazon_domain, search_term, credits, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [tuple(call) for call in calls])
+
+    def get_credit_usage(self, since: str) -> Dict[str, int]:
+        """Credits spent since `since` (ISO timestamp), per purpose"""
+        with self._reading() as conn:
+            rows = conn.execute('''
+                SELECT purpose, SUM(credits)
+                FROM api_calls
+                WHERE called_at >= ?
+                GROUP BY purpose
+            ''', (since,)).fetchall()
+        return {purpose: total or 0 for purpose, total in rows}
+
+    def record_price_observations(self, observations: List[PriceObservation]):
+        """Append a batch of checked prices to the price history"""
+        with self._transaction():
+            self.conn.executemany('''
+                INSERT INTO price_observations (observed_at, search_query, currency, price, marketplace)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [tuple(observation) for observation in observations])
+
+    def get_price_history(self, queries: List[Tuple[str, str]], since: float) -> List[Tuple[str, str, float, float]]:
+        """
+        (search_query, currency, observed_at, price) rows for the given (search_query, currency)
+        pairs observed since `since` (Unix seconds), ordered by query, then time.
+        """
+        rows = []
+        with self._reading() as conn:
+            for start in range(0, len(queries), _KEY_CHUNK):
+                chunk = queries[start:start + _KEY_CHUNK]
+                placeholders = ", ".join(["(?, ?)"] * len(chunk))
+                rows += conn.execute(f'''
+                    SELECT search_query, currency, observed_at, price
+                    FROM price_observations
+                    WHERE (search_query, currency) IN (VALUES {placeholders}) AND observed_at >= ?
+                    ORDER BY search_query, currency, observed_at
+                ''', [value for key in chunk for value in key] + [since]).fetchall()
+        return rows
+
+    def get_sweep_cursor(self) -> Optional[Dict]:
+        """Progress of the last price sweep, as saved by set_sweep_cursor (None before the first one)"""
+        with self._reading() as conn:
+            row = conn.execute('''
+                SELECT value FROM sweep_state WHERE name='cursor'
+            ''').fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_sweep_cursor(self, cursor: Dict):
+        with self._transaction():
+            self.conn.execute('''
+                INSERT OR REPLACE INTO sweep_state (name, value) VALUES ('cursor', ?)
+            ''', (json.dumps(cursor),))
+
+    def get_media_file_ids(self, limit: int) -> List[Tuple[str, str]]:
+        """Up to `limit` cached (key, file_id) pairs, most recently stored first"""
+        with self._reading() as conn:
+            return conn.execute('''
+                SELECT key, file_id FROM media_cache ORDER BY stored_at DESC LIMIT ?
+            ''', (limit,)).fetchall()
+
+    def save_media_file_ids(self, entries: List[Tuple[str, str]], evicted: List[str] = ()):
+        """Store (key, file_id) pairs and drop the `evicted` keys, in one transaction"""
+        now = datetime.now().timestamp()
+        with self._transaction():
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO media_cache (key, file_id, stored_at) VALUES (?, ?, ?)
+            ''', [(key, file_id, now) for key, file_id in entries])
+            self.conn.executemany('''
+                DELETE FROM media_cache WHERE key=?
+            ''', [(key,) for key in evicted])
+
+    def save_products(self, products: List[KnownProduct], keep: int):
+        """Upsert listings seen in searches, keeping only the `keep` most recently seen"""
+        with self._transaction():
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO products
+                (asin, title, price, currency, link, image, marketplace, category, search_query, seen_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(p.result.asin, p.result.title, p.result.price, p.result.currency, p.result.link, p.result.image,
+                   p.result.marketplace, p.category, p.search_query, p.seen_at) for p in products])
+            self.conn.execute('''
+                DELETE FROM products WHERE seen_at < (
+                    SELECT seen_at FROM products ORDER BY seen_at DESC LIMIT 1 OFFSET ?)
+            ''', (keep - 1,))
 
+    def get_products(self, limit: int) -> List[KnownProduct]:
+        """Up to `limit` listings, most recently seen first"""
+        with self._reading() as conn:
+            rows = conn.execute('''
+                SELECT asin, title, price, currency, link, image, marketplace, category, search_query, seen_at
+                FROM products ORDER BY seen_at DESC LIMIT ?
+            ''', (limit,)).fetchall()
+        return [KnownProduct.from_row(*row) for row in rows]